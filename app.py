@@ -1,6 +1,7 @@
 from litestar import Litestar
 from litestar.config.compression import CompressionConfig
 from litestar.logging import StructLoggingConfig
+from litestar.middleware import DefineMiddleware
 from litestar.openapi import OpenAPIConfig
 from litestar.openapi.plugins import ScalarRenderPlugin
 from litestar.plugins.structlog import StructlogConfig, StructlogPlugin
@@ -11,6 +12,9 @@ from structlog.processors import StackInfoRenderer, TimeStamper, add_log_level
 from structlog.stdlib import PositionalArgumentsFormatter
 
 from src import config, jwt_auth, routers, redis_user_service
+from src.api.middleware import ProfilerMiddleware, SSEAwareCompressionMiddleware
+from src.api.middleware.rate_limit_store import close_rate_limit_stores
+from src.api.routes.chat import flush_message_saves, flush_title_updates
 from init_admin_user import main as au
 from init_conversation_collections import main as cc
 
@@ -23,6 +27,11 @@ __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
 
+async def warmup_password_pool(_app):
+    """Warm up bcrypt thread pool before the first login"""
+    await redis_user_service.warmup_password_pool()
+
+
 async def cleanup_redis(_app):
     """Cleanup Redis connections on app shutdown"""
     await redis_user_service.close()
@@ -48,14 +57,26 @@ app = Litestar(  # Cách chạy server: chạy litestar run và server sẽ depl
     [routers],
     path=config.prefix,
     on_app_init=[jwt_auth.on_app_init],
-    on_startup=[au, cc],
-    on_shutdown=[cleanup_redis],
+    on_startup=[au, cc, warmup_password_pool],
+    on_shutdown=[
+        flush_message_saves,
+        flush_title_updates,
+        close_rate_limit_stores,
+        cleanup_redis,
+    ],
     plugins=[StructlogPlugin(StructlogConfig(logging_config)), GranianPlugin()],
+    middleware=[
+        *([ProfilerMiddleware] if config.profiling_enabled else []),
+        # Nén brotli, trừ response text/event-stream (SSE) xét theo từng response
+        DefineMiddleware(
+            SSEAwareCompressionMiddleware,
+            config=CompressionConfig(backend="brotli", brotli_gzip_fallback=False),
+        ),
+    ],
     # middleware=[
     #     LoggingMiddleware,
     # ],
     # cors_config=CORSMiddleware.get_cors_config(),
-    compression_config=CompressionConfig(backend="brotli", brotli_gzip_fallback=False),
     openapi_config=OpenAPIConfig(
         title="Chatbot hỗ trợ giới thiệu sản phẩm",
         version="1.0.0",
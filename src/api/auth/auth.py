@@ -1,7 +1,11 @@
-from datetime import datetime, timedelta
+import base64
+import hmac
+import time
+from datetime import timedelta
 from typing import Optional
 
 import jwt
+import msgspec
 from litestar.connection import ASGIConnection
 from litestar.exceptions import NotAuthorizedException
 from litestar.security.jwt import JWTAuth, Token
@@ -18,6 +22,37 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+# Key ký JWT chỉ chuẩn bị một lần khi import, không parse lại mỗi lần login
+_JWT_ALGORITHM = jwt.get_algorithm_by_name(config.jwt_algorithm)
+_SIGNING_KEY = _JWT_ALGORITHM.prepare_key(config.jwt_secret)
+_STATIC_HEADERS = {"typ": "JWT"}
+
+# HMAC algorithms được ký trực tiếp, không qua jwt.encode; hmac.digest với
+# tên digest dùng one-shot HMAC của OpenSSL (SHA-NI/ARMv8 crypto nếu có)
+_HMAC_DIGESTS = {"HS256": "sha256", "HS384": "sha384", "HS512": "sha512"}
+
+
+def _b64url(data: bytes) -> bytes:
+    """Base64url encode không padding (RFC 7515)"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class _TokenClaims(msgspec.Struct):
+    """JWT claims, encode trực tiếp bằng msgspec"""
+
+    sub: str
+    exp: int
+    iat: int
+    username: str
+    user_id: str
+
+
+# Header là hằng số nên serialize + base64 sẵn một lần
+_HEADER_B64 = _b64url(
+    msgspec.json.encode({"alg": config.jwt_algorithm, **_STATIC_HEADERS})
+)
+_claims_encoder = msgspec.json.Encoder()
+
 
 class AuthService:
     """JWT Authentication Service"""
@@ -40,6 +75,32 @@ class AuthService:
             await redis_user_service.update_user_last_login(username)
         return user
 
+    @staticmethod
+    async def login_attempts_exceeded(username: str, client_ip: str) -> bool:
+        """
+        Ghi nhận một lần login và kiểm tra giới hạn, trước khi chạy bcrypt
+
+        Args:
+            username: The username
+            client_ip: Client IP
+
+        Returns:
+            True nếu (username, IP) đã vượt config.login_attempt_limit
+        """
+        count = await redis_user_service.register_login_attempt(username, client_ip)
+        return count > config.login_attempt_limit
+
+    @staticmethod
+    async def clear_login_attempts(username: str, client_ip: str) -> None:
+        """
+        Reset bộ đếm login sau khi login thành công
+
+        Args:
+            username: The username
+            client_ip: Client IP
+        """
+        await redis_user_service.clear_login_attempts(username, client_ip)
+
     @staticmethod
     async def create_user(username: str, password: str) -> Optional[User]:
         """
@@ -82,8 +143,16 @@ class AuthService:
         if expires_delta is None:
             expires_delta = timedelta(hours=24)  # Default 24 hours
 
-        now = datetime.utcnow()
-        expire = now + expires_delta
+        now = int(time.time())
+        expire = now + int(expires_delta.total_seconds())
+
+        digest = _HMAC_DIGESTS.get(config.jwt_algorithm)
+        if digest is not None:
+            # Chỉ claims thay đổi theo user, header đã encode sẵn
+            claims = _TokenClaims(user.id, expire, now, user.username, user.id)
+            signing_input = _HEADER_B64 + b"." + _b64url(_claims_encoder.encode(claims))
+            signature = hmac.digest(_SIGNING_KEY, signing_input, digest)
+            return (signing_input + b"." + _b64url(signature)).decode("ascii")
 
         payload = {
             "sub": user.id,  # Use user ID as subject
@@ -93,7 +162,12 @@ class AuthService:
             "user_id": user.id,
         }
 
-        return jwt.encode(payload, config.jwt_secret, algorithm=config.jwt_algorithm)
+        return jwt.encode(
+            payload,
+            _SIGNING_KEY,
+            algorithm=config.jwt_algorithm,
+            headers=_STATIC_HEADERS,
+        )
 
 
 async def retrieve_user_handler(token: Token, connection: ASGIConnection) -> User:
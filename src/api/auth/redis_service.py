@@ -1,11 +1,15 @@
+import asyncio
+import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Optional
 
 import bcrypt
+import msgspec
 import redis.asyncio as redis
 
-from ...config import config
+from ...config import config, logger
 from ..schemas.auth import User
 
 __author__ = "Lâm Quang Trí"
@@ -16,17 +20,55 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+# bcrypt nhả GIL trong lúc hash/verify, nên chạy trên thread pool riêng là đủ
+# để không block event loop (và không chiếm default executor của asyncio)
+_PWD_POOL_WORKERS = os.cpu_count() or 1
+_pwd_pool = ThreadPoolExecutor(
+    max_workers=_PWD_POOL_WORKERS, thread_name_prefix="password-hash"
+)
+
+
+async def _run_in_pwd_pool(func, *args):
+    """Chạy hàm hash/verify password trên _pwd_pool"""
+    return await asyncio.get_running_loop().run_in_executor(_pwd_pool, func, *args)
+
+
+# Cache User DTO cho login: một GET thay cho GET index + HGETALL
+_AUTH_USER_CACHE_TTL = 60
+_user_encoder = msgspec.json.Encoder()
+_user_decoder = msgspec.json.Decoder(User)
+
+# Fixed window counter cho login: INCR + PEXPIRE nguyên tử trong một round-trip,
+# key không bao giờ bị kẹt lại mà không có TTL
+_LOGIN_ATTEMPT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+# Hash giả để username không tồn tại vẫn tốn đúng một lần verify bcrypt,
+# tránh lộ username qua thời gian phản hồi
+_DUMMY_HASH = bcrypt.hashpw(b"x", bcrypt.gensalt(rounds=config.bcrypt_rounds)).decode(
+    "utf-8"
+)
+
 
 class RedisUserService:
     """Redis-based user management service"""
 
     def __init__(self):
         self.redis_client = None
+        self._login_attempt_script = None
 
     async def get_redis_client(self) -> redis.Redis:
         """Get or create Redis client"""
         if self.redis_client is None:
             self.redis_client = redis.from_url(config.redis_url, decode_responses=True)
+            self._login_attempt_script = self.redis_client.register_script(
+                _LOGIN_ATTEMPT_SCRIPT
+            )
         return self.redis_client
 
     async def close(self):
@@ -34,18 +76,48 @@ class RedisUserService:
         if self.redis_client:
             await self.redis_client.close()
 
+    async def warmup_password_pool(self):
+        """Khởi tạo sẵn các thread của password pool bằng verify giả"""
+        await asyncio.gather(
+            *(
+                _run_in_pwd_pool(self._verify_password, "x", _DUMMY_HASH)
+                for _ in range(_PWD_POOL_WORKERS)
+            )
+        )
+
     @staticmethod
     def _hash_password(password: str) -> str:
         """Hash password using bcrypt"""
-        salt = bcrypt.gensalt()
+        salt = bcrypt.gensalt(rounds=config.bcrypt_rounds)
         hashed = bcrypt.hashpw(password.encode("utf-8"), salt)
         return hashed.decode("utf-8")
 
+    @staticmethod
+    def _user_from_hash(user_data: dict) -> User:
+        """Build User từ Redis hash (positional, đúng thứ tự field của User)"""
+        last_login = user_data.get("last_login")
+        return User(
+            user_data["id"],
+            user_data["username"],
+            user_data["password"],
+            datetime.fromisoformat(user_data["created_at"]),
+            user_data["is_active"] == "1",
+            datetime.fromisoformat(last_login) if last_login else None,
+        )
+
     @staticmethod
     def _verify_password(password: str, hashed_password: str) -> bool:
         """Verify password against hash"""
         return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
 
+    @staticmethod
+    def _needs_rehash(hashed_password: str) -> bool:
+        """Hash được tạo với cost khác config.bcrypt_rounds ($2b$<rounds>$...)"""
+        try:
+            return int(hashed_password.split("$")[2]) != config.bcrypt_rounds
+        except (IndexError, ValueError):
+            return True
+
     async def create_user(self, username: str, password: str) -> Optional[User]:
         """
         Create a new user with hashed password
@@ -67,28 +139,24 @@ class RedisUserService:
         user_id = str(uuid.uuid4())
 
         # Hash password
-        hashed_password = self._hash_password(password)
+        hashed_password = await _run_in_pwd_pool(self._hash_password, password)
 
         # Create user data as hash
+        created_at = datetime.now(timezone.utc)
         user_data = {
             "id": user_id,
             "username": username,
             "password": hashed_password,
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": created_at.isoformat(),
             "is_active": "1",  # Store as string for Redis compatibility
         }
 
         # Store user data in Redis as hash
         await redis_client.hset(f"user:{user_id}", mapping=user_data)
         await redis_client.set(f"index:{username}", user_id)
+        await redis_client.delete(f"auth:user:{username}")
 
-        return User(
-            id=user_id,
-            username=username,
-            hashed_password=hashed_password,
-            created_at=datetime.now(timezone.utc),
-            is_active=True,
-        )
+        return User(user_id, username, hashed_password, created_at, True)
 
     async def get_user_by_username(self, username: str) -> Optional[User]:
         """
@@ -102,21 +170,13 @@ class RedisUserService:
         """
         redis_client = await self.get_redis_client()
 
+        # Hai lệnh riêng (không dùng Lua) vì key user:{id} chỉ biết sau khi GET
+        # index, mà Redis Cluster yêu cầu script khai báo mọi key trong KEYS
         user_id = await redis_client.get(f"index:{username}")
         if not user_id:
             return None
 
-        user_data = await redis_client.hgetall(f"user:{user_id}")
-        if not user_data:
-            return None
-
-        return User(
-            id=user_data["id"],
-            username=user_data["username"],
-            hashed_password=user_data["password"],
-            created_at=datetime.fromisoformat(user_data["created_at"]),
-            is_active=user_data["is_active"] == "1",
-        )
+        return await self.get_user_by_id(user_id)
 
     async def get_user_by_id(self, user_id: str) -> Optional[User]:
         """
@@ -134,13 +194,32 @@ class RedisUserService:
         if not user_data:
             return None
 
-        return User(
-            id=user_data["id"],
-            username=user_data["username"],
-            hashed_password=user_data["password"],
-            created_at=datetime.fromisoformat(user_data["created_at"]),
-            is_active=user_data["is_active"] == "1",
-        )
+        return self._user_from_hash(user_data)
+
+    async def _get_auth_user(self, username: str) -> Optional[User]:
+        """
+        Get user cho authentication, cache trong auth:user:{username}
+
+        Args:
+            username: Username
+
+        Returns:
+            User object if found, None otherwise
+        """
+        redis_client = await self.get_redis_client()
+
+        cached = await redis_client.get(f"auth:user:{username}")
+        if cached:
+            return _user_decoder.decode(cached)
+
+        user = await self.get_user_by_username(username)
+        if user:
+            await redis_client.setex(
+                f"auth:user:{username}",
+                _AUTH_USER_CACHE_TTL,
+                _user_encoder.encode(user),
+            )
+        return user
 
     async def authenticate_user(self, username: str, password: str) -> Optional[User]:
         """
@@ -153,15 +232,55 @@ class RedisUserService:
         Returns:
             User object if authentication successful, None otherwise
         """
-        user = await self.get_user_by_username(username)
+        user = await self._get_auth_user(username)
         if not user or not user.is_active:
+            await _run_in_pwd_pool(self._verify_password, password, _DUMMY_HASH)
             return None
 
-        if not self._verify_password(password, user.hashed_password):
+        if not await _run_in_pwd_pool(
+            self._verify_password, password, user.hashed_password
+        ):
             return None
 
+        # Nâng cấp hash cũ sang cost hiện tại khi đã có plain password hợp lệ
+        if self._needs_rehash(user.hashed_password):
+            user.hashed_password = await _run_in_pwd_pool(self._hash_password, password)
+            redis_client = await self.get_redis_client()
+            await redis_client.hset(f"user:{user.id}", "password", user.hashed_password)
+            await redis_client.delete(f"auth:user:{username}")
+            logger.info("rehash", user_id=user.id, rounds=config.bcrypt_rounds)
+
         return user
 
+    async def register_login_attempt(self, username: str, client_ip: str) -> int:
+        """
+        Đếm số lần login của (username, IP) trong window hiện tại
+
+        Args:
+            username: Username
+            client_ip: Client IP
+
+        Returns:
+            Số lần login trong window, tính cả lần này
+        """
+        await self.get_redis_client()
+
+        return await self._login_attempt_script(
+            keys=[f"auth:fail:{username}:{client_ip}"],
+            args=[config.login_attempt_window_seconds * 1000],
+        )
+
+    async def clear_login_attempts(self, username: str, client_ip: str):
+        """
+        Reset bộ đếm login của (username, IP) sau khi login thành công
+
+        Args:
+            username: Username
+            client_ip: Client IP
+        """
+        redis_client = await self.get_redis_client()
+        await redis_client.delete(f"auth:fail:{username}:{client_ip}")
+
     async def update_user_last_login(self, username: str):
         """
         Update user's last login time
@@ -194,6 +313,7 @@ class RedisUserService:
             return False
 
         await redis_client.hset(f"user:{user_id}", "is_active", "0")
+        await redis_client.delete(f"auth:user:{username}")
         return True
 
 
@@ -2,14 +2,20 @@
 Middleware module for the API.
 """
 
+from .client_ip_middleware import ClientIPMiddleware
+from .compression_middleware import SSEAwareCompressionMiddleware
 from .cors_middleware import CORSMiddleware
 from .logging_middleware import LoggingMiddleware
+from .profiler_middleware import ProfilerMiddleware
 from .rate_limit_middleware import RateLimitMiddleware
 
 __all__ = [
     "CORSMiddleware",
+    "ClientIPMiddleware",
     "LoggingMiddleware",
+    "ProfilerMiddleware",
     "RateLimitMiddleware",
+    "SSEAwareCompressionMiddleware",
 ]
 
 __author__ = "Lâm Quang Trí"
@@ -0,0 +1,81 @@
+"""
+Client IP middleware: resolve client IP và request ID một lần cho mỗi request.
+"""
+
+import itertools
+import os
+
+from litestar.types import ASGIApp, Receive, Scope, Send
+
+__author__ = "Lâm Quang Trí"
+__copyright__ = "Copyright 2025, Lâm Quang Trí"
+__credits__ = ["Lâm Quang Trí"]
+
+__maintainer__ = "Lâm Quang Trí"
+__email__ = "quangtri.lam.9@gmail.com"
+__status__ = "Development"
+
+# Request ID = nonce của process + counter tăng dần, không cần syscall mỗi request
+_process_nonce = os.urandom(6).hex()
+_request_counter = itertools.count()
+
+
+def _reseed_request_ids() -> None:
+    """Tạo nonce mới cho process con để request ID không trùng giữa các worker."""
+    global _process_nonce, _request_counter
+    _process_nonce = os.urandom(6).hex()
+    _request_counter = itertools.count()
+
+
+os.register_at_fork(after_in_child=_reseed_request_ids)
+
+
+def get_client_ip(scope: Scope) -> str:
+    """Get client IP từ scope, parse headers và cache vào scope nếu chưa có."""
+    client_ip = scope.get("client_ip")
+    if client_ip:
+        return client_ip
+
+    # Kiểm tra các headers phổ biến cho real IP trong một lần duyệt
+    real_ip = None
+    for name, value in scope["headers"]:
+        if name == b"x-forwarded-for":
+            # Lấy IP đầu tiên nếu có nhiều
+            client_ip = value.split(b",", 1)[0].strip().decode("latin-1")
+            break
+        if name == b"x-real-ip":
+            real_ip = value
+    else:
+        if real_ip:
+            client_ip = real_ip.decode("latin-1")
+        else:
+            # Fallback to client IP từ scope
+            client = scope.get("client")
+            client_ip = client[0] if client else "unknown"
+
+    scope["client_ip"] = client_ip
+    return client_ip
+
+
+def get_request_id(scope: Scope) -> str:
+    """Get request ID từ scope, tạo mới nếu chưa có."""
+    request_id = scope.get("request_id")
+    if request_id is None:
+        request_id = f"{_process_nonce}{next(_request_counter):x}"
+        scope["request_id"] = request_id
+    return request_id
+
+
+class ClientIPMiddleware:
+    """Middleware gán scope["client_ip"] và scope["request_id"] cho các middleware phía sau."""
+
+    def __init__(self, app: ASGIApp):
+        """Initialize client IP middleware."""
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Resolve client IP và request ID trước khi chuyển tiếp request."""
+        if scope["type"] == "http":
+            get_client_ip(scope)
+            get_request_id(scope)
+        await self.app(scope, receive, send)
@@ -0,0 +1,62 @@
+"""
+Compression middleware bỏ qua SSE stream, quyết định theo từng response.
+"""
+
+from litestar.enums import CompressionEncoding
+from litestar.middleware.compression import CompressionMiddleware
+from litestar.types import Message, Scope, Send
+
+__author__ = "Lâm Quang Trí"
+__copyright__ = "Copyright 2025, Lâm Quang Trí"
+__credits__ = ["Lâm Quang Trí"]
+
+__maintainer__ = "Lâm Quang Trí"
+__email__ = "quangtri.lam.9@gmail.com"
+__status__ = "Development"
+
+_EVENT_STREAM = b"text/event-stream"
+
+
+def _is_event_stream(message: Message) -> bool:
+    """True nếu response start message khai báo Content-Type text/event-stream."""
+    for name, value in message.get("headers", ()):
+        if name.lower() == b"content-type":
+            return value.startswith(_EVENT_STREAM)
+    return False
+
+
+class SSEAwareCompressionMiddleware(CompressionMiddleware):
+    """
+    CompressionMiddleware không nén response text/event-stream
+
+    Nén SSE sẽ buffer chunk theo compression window. Một handler như /chat/
+    trả về JSON hoặc SSE tùy request, nên không thể loại trừ theo handler
+    (exclude_opt_key) mà phải xét Content-Type của từng response.
+
+    Đăng ký bằng DefineMiddleware(..., config=CompressionConfig(...)) thay cho
+    compression_config của app: Litestar 2.16 luôn dựng CompressionMiddleware
+    gốc từ compression_config, không dùng CompressionConfig.middleware_class.
+    """
+
+    def create_compression_send_wrapper(
+        self,
+        send: Send,
+        compression_encoding: CompressionEncoding | str,
+        scope: Scope,
+    ) -> Send:
+        """Wrap send: SSE response đi thẳng, còn lại qua send wrapper nén."""
+        compressed_send = super().create_compression_send_wrapper(
+            send, compression_encoding, scope
+        )
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal passthrough
+            if message["type"] == "http.response.start":
+                passthrough = _is_event_stream(message)
+            if passthrough:
+                await send(message)
+            else:
+                await compressed_send(message)
+
+        return send_wrapper
@@ -2,15 +2,13 @@
 Logging middleware cho request/response logging.
 """
 
+import logging
 import time
-import uuid
 
-from litestar import Request
-from litestar.middleware.base import AbstractMiddleware
 from litestar.types import ASGIApp, Receive, Scope, Send
 
 from ...config import logger
-
+from .client_ip_middleware import get_client_ip, get_request_id
 
 __author__ = "Lâm Quang Trí"
 __copyright__ = "Copyright 2025, Lâm Quang Trí"
@@ -20,13 +18,34 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+_RESP_START = "http.response.start"
+_HDR_USER_AGENT = b"user-agent"
+_INFO = logging.INFO
+
+_perf_counter = time.perf_counter
+
+
+class _StatusCaptureSend:
+    """Send wrapper ghi lại status code của response."""
+
+    __slots__ = ("send", "status_code")
 
-class LoggingMiddleware(AbstractMiddleware):
-    """Middleware để log requests và responses."""
+    def __init__(self, send: Send):
+        self.send = send
+        self.status_code = None
+
+    async def __call__(self, message) -> None:
+        if message["type"] == _RESP_START:
+            self.status_code = message["status"]
+        await self.send(message)
+
+
+class LoggingMiddleware:
+    """Middleware để log requests và responses (pure ASGI)."""
 
     def __init__(self, app: ASGIApp, exclude_paths: list[str] = None):
         """Initialize logging middleware."""
-        super().__init__(app)
+        self.app = app
         self.exclude_paths = exclude_paths or [
             "/health",
             "/metrics",
@@ -34,102 +53,74 @@ class LoggingMiddleware(AbstractMiddleware):
             "/schema",
             "/favicon.ico",
         ]
+        # Tuple cho phép str.startswith kiểm tra tất cả prefix trong C
+        self._exclude_paths = tuple(self.exclude_paths)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process request and response logging."""
+        app = self.app
         if scope["type"] != "http":
-            await self.app(scope, receive, send)
+            await app(scope, receive, send)
             return
 
-        # Generate request ID
-        request_id = str(uuid.uuid4())
-
-        # Get request info
-        request = Request(scope=scope, receive=receive)
-        path = request.url.path
-        method = request.method
+        path = scope["path"]
 
-        # Skip logging for excluded paths
-        if any(path.startswith(excluded) for excluded in self.exclude_paths):
-            await self.app(scope, receive, send)
+        # Skip logging for excluded paths - trước khi làm bất kỳ việc gì khác
+        if path.startswith(self._exclude_paths):
+            await app(scope, receive, send)
             return
 
-        # Add request ID to scope
-        scope["request_id"] = request_id
+        # Request ID dùng chung với các middleware khác
+        request_id = get_request_id(scope)
+        method = scope["method"]
 
         # Log request start
-        start_time = time.time()
-
-        client_ip = self._get_client_ip(request)
-        user_agent = request.headers.get("user-agent", "")
-
-        logger.info(
-            "Request started",
-            request_id=request_id,
-            method=method,
-            path=path,
-            client_ip=client_ip,
-            user_agent=user_agent,
-            query_params=dict(request.query_params) if request.query_params else None,
+        start_time = _perf_counter()
+
+        client_ip = get_client_ip(scope)
+
+        # Bind context một lần, dùng lại cho cả log start và completion
+        log = logger.bind(
+            request_id=request_id, method=method, path=path, client_ip=client_ip
         )
 
-        # Capture response
-        response_captured = {"status_code": None, "headers": None}
+        # Chỉ đọc user-agent và decode query string khi log INFO thực sự được ghi
+        if log.is_enabled_for(_INFO):
+            user_agent = None
+            for name, value in scope["headers"]:
+                if name == _HDR_USER_AGENT:
+                    user_agent = value
+                    break
+            query_string = scope.get("query_string")
+
+            log.info(
+                "Request started",
+                user_agent=user_agent.decode("latin-1") if user_agent else "",
+                query_params=query_string.decode("latin-1") if query_string else None,
+            )
 
-        async def send_wrapper(message):
-            if message["type"] == "http.response.start":
-                response_captured["status_code"] = message["status"]
-                response_captured["headers"] = dict(message.get("headers", []))
-            await send(message)
+        # Capture response
+        send_wrapper = _StatusCaptureSend(send)
 
         try:
-            await self.app(scope, receive, send_wrapper)
+            await app(scope, receive, send_wrapper)
 
             # Log successful response
-            end_time = time.time()
-            duration = end_time - start_time
+            duration = _perf_counter() - start_time
 
-            logger.info(
+            log.info(
                 "Request completed",
-                request_id=request_id,
-                method=method,
-                path=path,
-                status_code=response_captured["status_code"],
+                status_code=send_wrapper.status_code,
                 duration_ms=round(duration * 1000, 2),
-                client_ip=client_ip,
             )
 
         except Exception as e:
             # Log error
-            end_time = time.time()
-            duration = end_time - start_time
+            duration = _perf_counter() - start_time
 
-            logger.error(
+            log.error(
                 "Request failed",
-                request_id=request_id,
-                method=method,
-                path=path,
                 error=str(e),
                 duration_ms=round(duration * 1000, 2),
-                client_ip=client_ip,
             )
             raise
-
-    def _get_client_ip(self, request: Request) -> str:
-        """Get client IP address từ request."""
-        # Kiểm tra các headers phổ biến cho real IP
-        forwarded_for = request.headers.get("x-forwarded-for")
-        if forwarded_for:
-            # Lấy IP đầu tiên nếu có nhiều
-            return forwarded_for.split(",")[0].strip()
-
-        real_ip = request.headers.get("x-real-ip")
-        if real_ip:
-            return real_ip
-
-        # Fallback to client IP từ scope
-        client = request.scope.get("client")
-        if client:
-            return client[0]
-
-        return "unknown"
@@ -0,0 +1,80 @@
+"""
+Profiling middleware dùng pyinstrument, chỉ bật trong môi trường dev/debug.
+
+Gọi bất kỳ endpoint nào với ``?profile=1`` để nhận về báo cáo HTML của
+pyinstrument thay cho response thật.
+"""
+
+from urllib.parse import parse_qs
+
+from litestar.types import ASGIApp, Message, Receive, Scope, Send
+
+from ...config import logger
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+
+__author__ = "Lâm Quang Trí"
+__copyright__ = "Copyright 2025, Lâm Quang Trí"
+__credits__ = ["Lâm Quang Trí"]
+
+__maintainer__ = "Lâm Quang Trí"
+__email__ = "quangtri.lam.9@gmail.com"
+__status__ = "Development"
+
+
+def _wants_profile(query_string: bytes) -> bool:
+    """True nếu query string có đúng tham số ``profile=1``."""
+    if b"profile" not in query_string:
+        return False
+    return parse_qs(query_string.decode("latin-1")).get("profile") == ["1"]
+
+
+async def _discard(message: Message) -> None:
+    """Bỏ qua response thật khi đang profile."""
+
+
+class ProfilerMiddleware:
+    """Middleware trả về pyinstrument HTML report khi request có ?profile=1."""
+
+    def __init__(self, app: ASGIApp):
+        """Initialize profiler middleware."""
+        self.app = app
+        # Middleware chỉ được đăng ký khi profiling_enabled nên chỉ cảnh báo tại đây
+        if Profiler is None:
+            logger.warning(
+                "pyinstrument not installed. Request profiling will be disabled."
+            )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Profile request nếu được yêu cầu."""
+        if (
+            Profiler is None
+            or scope["type"] != "http"
+            or not _wants_profile(scope.get("query_string", b""))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, _discard)
+        finally:
+            profiler.stop()
+
+        body = profiler.output_html().encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/html; charset=utf-8"),
+                    (b"content-length", b"%d" % len(body)),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -3,17 +3,19 @@ Rate limiting middleware cho API protection.
 """
 
 import time
-from collections import defaultdict, deque
-from typing import Callable, Dict, Optional
+from typing import Callable, Optional
 
-from litestar import Request, Response
-from litestar.exceptions import HTTPException
-from litestar.middleware.base import AbstractMiddleware
 from litestar.status_codes import HTTP_429_TOO_MANY_REQUESTS
 from litestar.types import ASGIApp, Receive, Scope, Send
 
 from ...config import logger
-
+from .client_ip_middleware import get_client_ip
+from .rate_limit_store import (
+    RateLimitLimits,
+    RateLimitStore,
+    RateLimitUsage,
+    create_rate_limit_store,
+)
 
 __author__ = "Lâm Quang Trí"
 __copyright__ = "Copyright 2025, Lâm Quang Trí"
@@ -23,9 +25,40 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+_RESP_START = "http.response.start"
+_RESP_BODY = "http.response.body"
+
+# Header names encode sẵn
+_HDR_CONTENT_TYPE = b"content-type"
+_HDR_CONTENT_LENGTH = b"content-length"
+_HDR_RETRY_AFTER = b"retry-after"
+_HDR_LIMIT = b"x-ratelimit-limit"
+_HDR_REMAINING = b"x-ratelimit-remaining"
+_HDR_RESET = b"x-ratelimit-reset"
+_JSON_CONTENT_TYPE = b"application/json"
+
+_wall_time = time.time
+
+
+class _RateLimitSend:
+    """Send wrapper thêm rate limit headers vào response start message."""
+
+    __slots__ = ("headers_to_add", "send")
+
+    def __init__(self, send: Send, headers_to_add: list[tuple[bytes, bytes]]):
+        self.send = send
+        self.headers_to_add = headers_to_add
+
+    async def __call__(self, message) -> None:
+        if message["type"] == _RESP_START:
+            headers = list(message.get("headers", ()))
+            headers.extend(self.headers_to_add)
+            message["headers"] = headers
+        await self.send(message)
+
 
-class RateLimitMiddleware(AbstractMiddleware):
-    """Rate limiting middleware với sliding window algorithm."""
+class RateLimitMiddleware:
+    """Rate limiting middleware với sliding window algorithm (pure ASGI)."""
 
     def __init__(
         self,
@@ -34,10 +67,11 @@ class RateLimitMiddleware(AbstractMiddleware):
         requests_per_hour: int = 1000,
         burst_limit: int = 10,
         exclude_paths: list[str] = None,
-        key_func: Optional[Callable[[Request], str]] = None,
+        key_func: Optional[Callable[[Scope], str]] = None,
+        store: Optional[RateLimitStore] = None,
     ):
         """Initialize rate limit middleware."""
-        super().__init__(app)
+        self.app = app
         self.requests_per_minute = requests_per_minute
         self.requests_per_hour = requests_per_hour
         self.burst_limit = burst_limit
@@ -48,253 +82,134 @@ class RateLimitMiddleware(AbstractMiddleware):
             "/schema",
             "/favicon.ico",
         ]
+        self._exclude_paths = tuple(self.exclude_paths)
         self.key_func = key_func or self._default_key_func
 
-        # Storage cho rate limiting
-        self._minute_windows: Dict[str, deque] = defaultdict(deque)
-        self._hour_windows: Dict[str, deque] = defaultdict(deque)
-        self._burst_windows: Dict[str, deque] = defaultdict(deque)
+        # Response 429 được encode sẵn, chỉ thay retry_after mỗi lần
+        self._body_tmpl = (
+            b'{"error":true,"message":"Rate limit exceeded","retry_after":%d}'
+        )
 
-        # Cleanup interval
-        self._last_cleanup = time.time()
-        self._cleanup_interval = 60  # 1 minute
+        # Storage cho rate limiting (memory hoặc Redis theo config)
+        self.store = store or create_rate_limit_store()
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process request với rate limiting."""
+        app = self.app
         if scope["type"] != "http":
-            await self.app(scope, receive, send)
+            await app(scope, receive, send)
             return
 
-        request = Request(scope=scope, receive=receive)
-        path = request.url.path
-
         # Skip rate limiting for excluded paths
-        if any(path.startswith(excluded) for excluded in self.exclude_paths):
-            await self.app(scope, receive, send)
+        if scope["path"].startswith(self._exclude_paths):
+            await app(scope, receive, send)
             return
 
         # Get client key
-        client_key = self.key_func(request)
+        client_key = self.key_func(scope)
 
-        # Cleanup old entries periodically
-        current_time = time.time()
-        if current_time - self._last_cleanup > self._cleanup_interval:
-            self._cleanup_old_entries(current_time)
-            self._last_cleanup = current_time
+        limits = self._get_limits(client_key)
+        usage = await self.store.acquire(client_key, limits)
+
+        # Limit và Remaining cùng lấy từ limits của client (user có thể có limit riêng)
+        limit_bytes = b"%d" % limits.minute
+        reset_bytes = b"%d" % (int(_wall_time()) + 60)
 
         # Check rate limits
-        try:
-            self._check_rate_limits(client_key, current_time)
-        except HTTPException:
-            # Send rate limit exceeded response
-            response = Response(
-                content={
-                    "error": True,
-                    "message": "Rate limit exceeded",
-                    "retry_after": self._get_retry_after(client_key, current_time),
-                },
-                status_code=HTTP_429_TOO_MANY_REQUESTS,
-                headers={
-                    "Retry-After": str(self._get_retry_after(client_key, current_time)),
-                    "X-RateLimit-Limit": str(self.requests_per_minute),
-                    "X-RateLimit-Remaining": "0",
-                    "X-RateLimit-Reset": str(int(current_time + 60)),
-                },
+        if self._is_rate_limited(client_key, usage, limits):
+            # Send rate limit exceeded response (body encode sẵn, không qua serializer)
+            retry_after = usage.retry_after
+            body = self._body_tmpl % retry_after
+            await send(
+                {
+                    "type": _RESP_START,
+                    "status": HTTP_429_TOO_MANY_REQUESTS,
+                    "headers": [
+                        (_HDR_CONTENT_TYPE, _JSON_CONTENT_TYPE),
+                        (_HDR_CONTENT_LENGTH, b"%d" % len(body)),
+                        (_HDR_RETRY_AFTER, b"%d" % retry_after),
+                        (_HDR_LIMIT, limit_bytes),
+                        (_HDR_REMAINING, b"0"),
+                        (_HDR_RESET, reset_bytes),
+                    ],
+                }
             )
-
-            await response(scope, receive, send)
+            await send({"type": _RESP_BODY, "body": body})
             return
 
-        # Record the request
-        self._record_request(client_key, current_time)
+        # Request hiện tại đã được store ghi nhận
+        remaining = max(0, limits.minute - usage.minute - 1)
 
         # Add rate limit headers to response
-        remaining = self._get_remaining_requests(client_key, current_time)
-
-        async def send_wrapper(message):
-            if message["type"] == "http.response.start":
-                headers = dict(message.get("headers", []))
-                headers.update(
-                    {
-                        b"X-RateLimit-Limit": str(self.requests_per_minute).encode(),
-                        b"X-RateLimit-Remaining": str(remaining).encode(),
-                        b"X-RateLimit-Reset": str(int(current_time + 60)).encode(),
-                    }
-                )
-                message["headers"] = list(headers.items())
-            await send(message)
-
-        await self.app(scope, receive, send_wrapper)
-
-    def _default_key_func(self, request: Request) -> str:
+        rate_limit_headers = [
+            (_HDR_LIMIT, limit_bytes),
+            (_HDR_REMAINING, b"%d" % remaining),
+            (_HDR_RESET, reset_bytes),
+        ]
+
+        await app(scope, receive, _RateLimitSend(send, rate_limit_headers))
+
+    def _default_key_func(self, scope: Scope) -> str:
         """Default function để tạo client key."""
         # Ưu tiên user ID nếu có authentication
-        user_id = getattr(request.scope.get("user"), "id", None)
+        user_id = getattr(scope.get("user"), "id", None)
         if user_id:
             return f"user:{user_id}"
 
         # Fallback to IP address
-        client_ip = self._get_client_ip(request)
-        return f"ip:{client_ip}"
-
-    def _get_client_ip(self, request: Request) -> str:
-        """Get client IP address."""
-        # Check forwarded headers
-        forwarded_for = request.headers.get("x-forwarded-for")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
+        return f"ip:{get_client_ip(scope)}"
 
-        real_ip = request.headers.get("x-real-ip")
-        if real_ip:
-            return real_ip
-
-        # Fallback to client from scope
-        client = request.scope.get("client")
-        if client:
-            return client[0]
-
-        return "unknown"
+    def _get_limits(self, client_key: str) -> RateLimitLimits:
+        """Get limits áp dụng cho client."""
+        return RateLimitLimits(
+            self.burst_limit, self.requests_per_minute, self.requests_per_hour
+        )
 
-    def _check_rate_limits(self, client_key: str, current_time: float) -> None:
-        """Kiểm tra rate limits cho client."""
+    def _is_rate_limited(
+        self, client_key: str, usage: RateLimitUsage, limits: RateLimitLimits
+    ) -> bool:
+        """Kiểm tra rate limits cho client, không raise exception trên deny path."""
         # Check burst limit (last 10 seconds)
-        burst_window = self._burst_windows[client_key]
-        burst_cutoff = current_time - 10
-        while burst_window and burst_window[0] < burst_cutoff:
-            burst_window.popleft()
-
-        if len(burst_window) >= self.burst_limit:
-            logger.warning(f"Burst rate limit exceeded for {client_key}")
-            raise HTTPException(
-                status_code=HTTP_429_TOO_MANY_REQUESTS,
-                detail="Burst rate limit exceeded",
-            )
+        if usage.burst >= limits.burst:
+            logger.warning("Burst rate limit exceeded for %s", client_key)
+            return True
 
         # Check minute limit
-        minute_window = self._minute_windows[client_key]
-        minute_cutoff = current_time - 60
-        while minute_window and minute_window[0] < minute_cutoff:
-            minute_window.popleft()
-
-        if len(minute_window) >= self.requests_per_minute:
-            logger.warning(f"Minute rate limit exceeded for {client_key}")
-            raise HTTPException(
-                status_code=HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded"
-            )
+        if usage.minute >= limits.minute:
+            logger.warning("Minute rate limit exceeded for %s", client_key)
+            return True
 
         # Check hour limit
-        hour_window = self._hour_windows[client_key]
-        hour_cutoff = current_time - 3600
-        while hour_window and hour_window[0] < hour_cutoff:
-            hour_window.popleft()
-
-        if len(hour_window) >= self.requests_per_hour:
-            logger.warning(f"Hour rate limit exceeded for {client_key}")
-            raise HTTPException(
-                status_code=HTTP_429_TOO_MANY_REQUESTS,
-                detail="Hourly rate limit exceeded",
-            )
-
-    def _record_request(self, client_key: str, current_time: float) -> None:
-        """Record request timestamp."""
-        self._burst_windows[client_key].append(current_time)
-        self._minute_windows[client_key].append(current_time)
-        self._hour_windows[client_key].append(current_time)
-
-    def _get_remaining_requests(self, client_key: str, current_time: float) -> int:
-        """Get số requests còn lại trong minute window."""
-        minute_window = self._minute_windows[client_key]
-        minute_cutoff = current_time - 60
+        if usage.hour >= limits.hour:
+            logger.warning("Hour rate limit exceeded for %s", client_key)
+            return True
 
-        # Count requests trong minute window
-        valid_requests = sum(
-            1 for timestamp in minute_window if timestamp >= minute_cutoff
-        )
-        return max(0, self.requests_per_minute - valid_requests)
-
-    def _get_retry_after(self, client_key: str, current_time: float) -> int:
-        """Get retry after seconds."""
-        minute_window = self._minute_windows[client_key]
-        if not minute_window:
-            return 1
-
-        # Tìm request cũ nhất trong window
-        oldest_request = minute_window[0]
-        retry_after = int(oldest_request + 60 - current_time)
-        return max(1, retry_after)
-
-    def _cleanup_old_entries(self, current_time: float) -> None:
-        """Cleanup old entries để tiết kiệm memory."""
-        keys_to_remove = []
-
-        # Cleanup minute windows
-        for client_key, window in self._minute_windows.items():
-            minute_cutoff = current_time - 60
-            while window and window[0] < minute_cutoff:
-                window.popleft()
-            if not window:
-                keys_to_remove.append(client_key)
-
-        for key in keys_to_remove:
-            del self._minute_windows[key]
-
-        # Cleanup hour windows
-        keys_to_remove = []
-        for client_key, window in self._hour_windows.items():
-            hour_cutoff = current_time - 3600
-            while window and window[0] < hour_cutoff:
-                window.popleft()
-            if not window:
-                keys_to_remove.append(client_key)
-
-        for key in keys_to_remove:
-            del self._hour_windows[key]
-
-        # Cleanup burst windows
-        keys_to_remove = []
-        for client_key, window in self._burst_windows.items():
-            burst_cutoff = current_time - 10
-            while window and window[0] < burst_cutoff:
-                window.popleft()
-            if not window:
-                keys_to_remove.append(client_key)
-
-        for key in keys_to_remove:
-            del self._burst_windows[key]
-
-        logger.debug(
-            f"Rate limit cleanup completed. Active clients: {len(self._minute_windows)}"
-        )
+        return False
 
 
 class APIKeyRateLimitMiddleware(RateLimitMiddleware):
     """Rate limiting với different limits cho API keys."""
 
-    def __init__(self, app: ASGIApp, **kwargs):
+    def __init__(
+        self,
+        app: ASGIApp,
+        api_key_requests_per_minute: int = 300,
+        api_key_requests_per_hour: int = 10000,
+        **kwargs,
+    ):
         super().__init__(app, **kwargs)
         # API keys có higher limits
-        self.api_key_requests_per_minute = kwargs.get(
-            "api_key_requests_per_minute", 300
-        )
-        self.api_key_requests_per_hour = kwargs.get("api_key_requests_per_hour", 10000)
+        self.api_key_requests_per_minute = api_key_requests_per_minute
+        self.api_key_requests_per_hour = api_key_requests_per_hour
 
-    def _check_rate_limits(self, client_key: str, current_time: float) -> None:
+    def _get_limits(self, client_key: str) -> RateLimitLimits:
         """Override để áp dụng different limits cho API keys."""
-        # Check if this is an API key user
+        # Use higher limits for authenticated users
         if client_key.startswith("user:"):
-            # Use higher limits for authenticated users
-            original_minute_limit = self.requests_per_minute
-            original_hour_limit = self.requests_per_hour
-
-            self.requests_per_minute = self.api_key_requests_per_minute
-            self.requests_per_hour = self.api_key_requests_per_hour
-
-            try:
-                super()._check_rate_limits(client_key, current_time)
-            finally:
-                # Restore original limits
-                self.requests_per_minute = original_minute_limit
-                self.requests_per_hour = original_hour_limit
-        else:
-            # Use default limits for IP-based requests
-            super()._check_rate_limits(client_key, current_time)
+            return RateLimitLimits(
+                self.burst_limit,
+                self.api_key_requests_per_minute,
+                self.api_key_requests_per_hour,
+            )
+        # Use default limits for IP-based requests
+        return super()._get_limits(client_key)
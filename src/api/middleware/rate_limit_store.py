@@ -0,0 +1,275 @@
+"""
+Storage backends cho rate limiting middleware.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import redis.asyncio as redis
+
+from ...config import config, logger
+
+__author__ = "Lâm Quang Trí"
+__copyright__ = "Copyright 2025, Lâm Quang Trí"
+__credits__ = ["Lâm Quang Trí"]
+
+__maintainer__ = "Lâm Quang Trí"
+__email__ = "quangtri.lam.9@gmail.com"
+__status__ = "Development"
+
+# Window sizes tính bằng nanoseconds (time.monotonic_ns)
+_NS_PER_SECOND = 1_000_000_000
+_BURST_WINDOW_NS = 10 * _NS_PER_SECOND
+_MINUTE_WINDOW_NS = 60 * _NS_PER_SECOND
+_HOUR_WINDOW_NS = 3600 * _NS_PER_SECOND
+
+_monotonic_ns = time.monotonic_ns
+
+
+class RateLimitLimits(NamedTuple):
+    """Giới hạn request cho mỗi window."""
+
+    burst: int
+    minute: int
+    hour: int
+
+
+class RateLimitUsage(NamedTuple):
+    """Số request đã dùng trong mỗi window, tính trước request hiện tại."""
+
+    burst: int
+    minute: int
+    hour: int
+    retry_after: int
+
+
+class RateLimitStore:
+    """Interface cho storage của rate limiter."""
+
+    async def acquire(self, client_key: str, limits: RateLimitLimits) -> RateLimitUsage:
+        """
+        Kiểm tra và ghi nhận một request cho client
+
+        Request chỉ được ghi nhận nếu cả ba window đều còn dưới giới hạn.
+
+        Args:
+            client_key: Key của client (user hoặc IP)
+            limits: Giới hạn cho burst/minute/hour window
+
+        Returns:
+            Usage của client trước khi ghi nhận request này
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Giải phóng tài nguyên của store."""
+
+
+class _WindowCounter:
+    """Sliding window counter: chỉ giữ số request của window hiện tại và window trước."""
+
+    __slots__ = ("current", "previous", "size", "start")
+
+    def __init__(self, size: int, now: int):
+        self.size = size
+        self.start = now
+        self.current = 0
+        self.previous = 0
+
+    def _rotate(self, now: int) -> None:
+        """Chuyển sang window mới nếu window hiện tại đã hết hạn."""
+        elapsed = now - self.start
+        if elapsed < self.size:
+            return
+        if elapsed < 2 * self.size:
+            self.previous = self.current
+            self.start += self.size
+        else:
+            # Cả hai window đều đã hết hạn
+            self.previous = 0
+            self.start = now
+        self.current = 0
+
+    def estimate(self, now: int) -> int:
+        """Ước lượng số request trong sliding window kết thúc tại now."""
+        self._rotate(now)
+        remaining = self.size - (now - self.start)
+        return self.current + self.previous * remaining // self.size
+
+    def hit(self, now: int) -> None:
+        """Ghi nhận một request."""
+        self._rotate(now)
+        self.current += 1
+
+    def expired(self, now: int) -> bool:
+        """Counter không còn ảnh hưởng tới rate limit."""
+        return now - self.start >= 2 * self.size
+
+
+class InProcessRateLimitStore(RateLimitStore):
+    """Rate limit store trong memory của process (sliding window counter)."""
+
+    def __init__(self, sweep_budget: int = 64, max_clients: int = 100_000):
+        """Initialize in-process store."""
+        # (burst, minute, hour) counters cho mỗi client, theo thứ tự LRU
+        self._state: OrderedDict[
+            str, tuple[_WindowCounter, _WindowCounter, _WindowCounter]
+        ] = OrderedDict()
+        # Giới hạn số client để tránh bị spoof X-Forwarded-For làm phình memory
+        self._max_clients = max_clients
+
+        # Incremental cleanup: mỗi lần chỉ bỏ tối đa _sweep_budget keys từ đầu LRU
+        self._last_cleanup = _monotonic_ns()
+        self._cleanup_interval = _NS_PER_SECOND  # 1 second
+        self._sweep_budget = sweep_budget
+
+    async def acquire(self, client_key: str, limits: RateLimitLimits) -> RateLimitUsage:
+        """Kiểm tra và ghi nhận request trong memory."""
+        current_time = _monotonic_ns()
+        if current_time - self._last_cleanup > self._cleanup_interval:
+            self._incremental_sweep(current_time)
+            self._last_cleanup = current_time
+
+        state = self._state.get(client_key)
+        if state is None:
+            state = (
+                _WindowCounter(_BURST_WINDOW_NS, current_time),
+                _WindowCounter(_MINUTE_WINDOW_NS, current_time),
+                _WindowCounter(_HOUR_WINDOW_NS, current_time),
+            )
+            self._state[client_key] = state
+            if len(self._state) > self._max_clients:
+                # Evict client ít dùng gần đây nhất
+                self._state.popitem(last=False)
+        else:
+            self._state.move_to_end(client_key)
+
+        burst, minute, hour = state
+        burst_count = burst.estimate(current_time)
+        minute_count = minute.estimate(current_time)
+        hour_count = hour.estimate(current_time)
+
+        if (
+            burst_count < limits.burst
+            and minute_count < limits.minute
+            and hour_count < limits.hour
+        ):
+            burst.hit(current_time)
+            minute.hit(current_time)
+            hour.hit(current_time)
+            retry_after = 0
+        else:
+            # Đợi tới khi minute window hiện tại kết thúc
+            retry_after = max(
+                1, (minute.start + minute.size - current_time) // _NS_PER_SECOND
+            )
+
+        return RateLimitUsage(burst_count, minute_count, hour_count, retry_after)
+
+    def _incremental_sweep(self, current_time: int) -> None:
+        """
+        Cleanup expired entries từ đầu LRU, tối đa _sweep_budget keys mỗi lần
+
+        Client ít dùng gần đây nhất nằm ở đầu OrderedDict nên cũng là client
+        hết hạn sớm nhất; dừng ở client đầu tiên còn hiệu lực.
+        """
+        state = self._state
+        removed = 0
+        while state and removed < self._sweep_budget:
+            client_key = next(iter(state))
+            if not state[client_key][2].expired(current_time):
+                break
+            del state[client_key]
+            removed += 1
+
+        if removed:
+            logger.debug(
+                "Rate limit sweep removed %d clients. Active clients: %d",
+                removed,
+                len(self._state),
+            )
+
+
+# Sliding window log trên sorted set, thực hiện atomic trong một round-trip
+_ACQUIRE_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - 3600000)
+local hour = redis.call('ZCARD', key)
+local minute = redis.call('ZCOUNT', key, now - 60000, '+inf')
+local burst = redis.call('ZCOUNT', key, now - 10000, '+inf')
+local retry_after = 0
+if burst < tonumber(ARGV[2]) and minute < tonumber(ARGV[3]) and hour < tonumber(ARGV[4]) then
+    redis.call('ZADD', key, now, ARGV[5])
+    redis.call('PEXPIRE', key, 3600000)
+else
+    local oldest = redis.call('ZRANGEBYSCORE', key, now - 60000, '+inf', 'WITHSCORES', 'LIMIT', 0, 1)
+    retry_after = 1
+    if oldest[2] then
+        retry_after = math.max(1, math.ceil((tonumber(oldest[2]) + 60000 - now) / 1000))
+    end
+end
+return {burst, minute, hour, retry_after}
+"""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """Rate limit store dùng Redis, chia sẻ giới hạn giữa các worker."""
+
+    def __init__(self, redis_url: str = config.redis_url, prefix: str = "ratelimit:"):
+        """Initialize Redis store."""
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self.redis_client = None
+        self._acquire_script = None
+
+    async def get_redis_client(self) -> redis.Redis:
+        """Get or create Redis client"""
+        if self.redis_client is None:
+            self.redis_client = redis.from_url(self.redis_url)
+            # register_script dùng EVALSHA, tự fallback sang EVAL nếu script chưa load
+            self._acquire_script = self.redis_client.register_script(_ACQUIRE_SCRIPT)
+        return self.redis_client
+
+    async def close(self) -> None:
+        """Close Redis connection"""
+        if self.redis_client:
+            await self.redis_client.close()
+
+    async def acquire(self, client_key: str, limits: RateLimitLimits) -> RateLimitUsage:
+        """Kiểm tra và ghi nhận request bằng Lua script."""
+        await self.get_redis_client()
+        now_ms = time.time_ns() // 1_000_000
+        burst, minute, hour, retry_after = await self._acquire_script(
+            keys=[f"{self.prefix}{client_key}"],
+            args=[
+                now_ms,
+                limits.burst,
+                limits.minute,
+                limits.hour,
+                os.urandom(8).hex(),
+            ],
+        )
+        return RateLimitUsage(burst, minute, hour, retry_after)
+
+
+# Các store do create_rate_limit_store tạo, đóng lại khi app shutdown
+_created_stores: list[RateLimitStore] = []
+
+
+def create_rate_limit_store() -> RateLimitStore:
+    """Tạo rate limit store theo config.rate_limit_storage ("memory" hoặc "redis")."""
+    if config.rate_limit_storage == "redis":
+        store = RedisRateLimitStore(redis_url=config.redis_url)
+    else:
+        store = InProcessRateLimitStore()
+    _created_stores.append(store)
+    return store
+
+
+async def close_rate_limit_stores(_app=None) -> None:
+    """Đóng các store đã tạo (dùng khi shutdown)."""
+    while _created_stores:
+        await _created_stores.pop().close()
@@ -1,13 +1,18 @@
-from litestar import Controller, post
+from datetime import timedelta
+from typing import Any, Final
+
+from litestar import Controller, Request, post
 from litestar.exceptions import (
-    InternalServerException,
+    ClientException,
     NotAuthorizedException,
+    TooManyRequestsException,
 )
-from litestar.status_codes import HTTP_201_CREATED
+from litestar.status_codes import HTTP_201_CREATED, HTTP_409_CONFLICT
 
 from ...config import logger
 from ..auth import AuthService
 from ..schemas import LoginRequest, LoginResponse, RegisterRequest, RegisterResponse
+from .errors import error_boundary
 
 __author__ = "Lâm Quang Trí"
 __copyright__ = "Copyright 2025, Lâm Quang Trí"
@@ -17,6 +22,10 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+# Thời hạn token (24h), dùng chung cho exp trong JWT và expires_in trả về
+_TOKEN_TTL_SECONDS: Final[int] = 86_400
+_TOKEN_TTL: Final[timedelta] = timedelta(seconds=_TOKEN_TTL_SECONDS)
+
 
 class Auth(Controller):
     """Authentication router for login functionality"""
@@ -25,11 +34,15 @@ class Auth(Controller):
     tags = ["Authentication"]
 
     @post("/login")
-    async def login(self, data: LoginRequest) -> LoginResponse:
+    @error_boundary("Login", detail="Error creating authentication token")
+    async def login(
+        self, request: Request[Any, Any, Any], data: LoginRequest
+    ) -> LoginResponse:
         """
         Authenticate user and return JWT token
 
         Args:
+            request: HTTP request
             data: Login credentials (username and password)
 
         Returns:
@@ -37,9 +50,22 @@ class Auth(Controller):
 
         Raises:
             NotAuthorizedException: If credentials are invalid
+            TooManyRequestsException: If too many login attempts were made
             InternalServerException: If token creation fails
         """
-        logger.info("Login attempt", username=data.username)
+        logger.debug("Login attempt", username=data.username)
+
+        # Chặn brute force bằng một round-trip Redis, trước khi chạy bcrypt.
+        # Key theo địa chỉ peer của kết nối, không theo X-Forwarded-For vì
+        # client tự đặt được header này để né giới hạn
+        client_ip = request.client.host if request.client else "unknown"
+        if await AuthService.login_attempts_exceeded(data.username, client_ip):
+            logger.warning(
+                "Too many login attempts", username=data.username, client_ip=client_ip
+            )
+            raise TooManyRequestsException(
+                detail="Too many login attempts, please try again later"
+            )
 
         # Authenticate user
         user = await AuthService.authenticate_user(data.username, data.password)
@@ -48,24 +74,22 @@ class Auth(Controller):
             logger.warning("Invalid login attempt", username=data.username)
             raise NotAuthorizedException(detail="Invalid username or password")
 
+        await AuthService.clear_login_attempts(data.username, client_ip)
+
         # Create JWT token
-        try:
-            token = AuthService.create_token(user)
-            logger.info("Login successful", username=data.username, user_id=user.id)
-
-            return LoginResponse(
-                access_token=token,
-                token_type="bearer",
-                expires_in=24 * 60 * 60,  # 24 hours in seconds
-                user_id=user.id,
-                username=user.username,
-            )
+        token = AuthService.create_token(user, _TOKEN_TTL)
+        logger.debug("Login successful", username=data.username, user_id=user.id)
 
-        except Exception as e:
-            logger.error("Error creating token", username=data.username, error=str(e))
-            raise InternalServerException(detail="Error creating authentication token")
+        return LoginResponse(
+            access_token=token,
+            token_type="bearer",
+            expires_in=_TOKEN_TTL_SECONDS,
+            user_id=user.id,
+            username=user.username,
+        )
 
     @post("/register", status_code=HTTP_201_CREATED)
+    @error_boundary("Registration", detail="Error creating user account")
     async def register(self, data: RegisterRequest) -> RegisterResponse:
         """
         Register a new user
@@ -77,29 +101,24 @@ class Auth(Controller):
             RegisterResponse with user info
 
         Raises:
-            ConflictException: If username already exists
+            ClientException: If username already exists (409)
             InternalServerException: If user creation fails
         """
-        logger.info("Registration attempt", username=data.username)
-
-        try:
-            # Create new user
-            user = await AuthService.create_user(data.username, data.password)
+        logger.debug("Registration attempt", username=data.username)
 
-            if not user:
-                logger.warning("Username already exists", username=data.username)
-                raise Exception("Username already exists")
+        # Create new user
+        user = await AuthService.create_user(data.username, data.password)
 
-            logger.info(
-                "Registration successful", username=data.username, user_id=user.id
+        if not user:
+            logger.warning("Username already exists", username=data.username)
+            raise ClientException(
+                detail="Username already exists", status_code=HTTP_409_CONFLICT
             )
 
-            return RegisterResponse(
-                user_id=user.id,
-                username=user.username,
-                message="User registered successfully",
-            )
+        logger.debug("Registration successful", username=data.username, user_id=user.id)
 
-        except Exception as e:
-            logger.error("Error creating user", username=data.username, error=str(e))
-            raise InternalServerException(detail="Error creating user account")
+        return RegisterResponse(
+            user_id=user.id,
+            username=user.username,
+            message="User registered successfully",
+        )
@@ -3,13 +3,18 @@ Chat routes cho chatbot interactions với streaming support.
 """
 
 import asyncio
-import json
+import contextlib
+import re
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import AsyncIterator, Dict, List, Optional, Any
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
 
-from litestar import Controller, delete, get, post, Request
-from litestar.exceptions import HTTPException
+import msgspec
+from litestar import Controller, MediaType, Request, Response, delete, get, post
+from litestar.exceptions import HTTPException, TooManyRequestsException
 from litestar.security.jwt import Token
 from litestar.response import Stream
 from litestar.status_codes import (
@@ -30,11 +35,16 @@ from ..schemas import (
     ConversationCreate,
     ConversationHistory,
     ConversationResponse,
+    IntentAnalysisResponse,
+    OrderFlowCapabilities,
+    OrderFlowStatus,
     SearchInfoResponse,
     SuccessResponse,
+    TitleUpdate,
     User,
 )
 from ..services import ConversationService
+from .errors import error_boundary
 
 __author__ = "Lâm Quang Trí"
 __copyright__ = "Copyright 2025, Lâm Quang Trí"
@@ -48,33 +58,307 @@ __status__ = "Development"
 _facade_instance: Optional[ProductAssistantFacade] = None
 _conversation_service: Optional[ConversationService] = None
 
+# Khóa cho lazy init: request đồng thời lúc cold start chỉ tạo một instance
+_facade_lock = threading.Lock()
+_conversation_service_lock = asyncio.Lock()
+
+# Message của streaming chat được lưu bởi vài worker nền; mỗi conversation luôn
+# vào cùng một queue nên thứ tự lưu được giữ. Queue đầy thì stream chờ (backpressure)
+_MESSAGE_SAVE_WORKERS = 4
+_MESSAGE_SAVE_QUEUE_MAXSIZE = 256
+_message_save_queues: List[asyncio.Queue] = []
+_message_save_workers: List[Optional[asyncio.Task]] = [None] * _MESSAGE_SAVE_WORKERS
+
+# Title update được gom theo conversation (chỉ giữ title mới nhất) rồi ghi theo batch
+_TITLE_FLUSH_INTERVAL = 0.05
+_pending_titles: Dict[str, Tuple[str, str]] = {}
+_title_update_worker: Optional[asyncio.Task] = None
+_WS_ONLY = re.compile(r"\s*").fullmatch
+
+# SSE framing: encode Struct trực tiếp bằng msgspec, không qua dict + json.dumps
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_encoder = msgspec.json.Encoder()
+
+# Snapshot của /order-flow-status; agent chỉ đổi khi deploy nên cache theo TTL
+_ORDER_FLOW_STATUS_TTL = 5.0
+_order_flow_status_cache: Dict[str, Any] = {"fetched_at": 0.0, "payload": None}
+# get_stats() chạy song song với việc build response, chờ tối đa _STATS_TIMEOUT;
+# quá hạn thì dùng stats gần nhất (nếu chưa quá _STATS_STALE_TTL)
+_STATS_TIMEOUT = 0.05
+_STATS_STALE_TTL = 30.0
+_last_agent_stats: Dict[str, Any] = {"fetched_at": 0.0, "stats": None}
+# Single-flight: các request đồng thời dùng chung một lần get_stats()
+_agent_stats_inflight: Optional[asyncio.Future] = None
+# Phần cố định của response, build lại khi capabilities của facade thay đổi
+_status_skeleton: Tuple[Optional[Dict[str, Any]], Optional[OrderFlowStatus]] = (
+    None,
+    None,
+)
+
+# Intent analysis trả về khi agent không hỗ trợ (không bị sửa, dùng chung mọi request)
+_LEGACY_INTENT_ANALYSIS: Dict[str, Any] = {
+    "intent_type": "PRODUCT_CONSULTATION",
+    "confidence": 0.0,
+    "score": 0,
+    "triggers": (),
+    "note": "Intent analysis not available with current agent",
+}
+
+# Gợi ý câu hỏi cố định, encode sẵn một lần khi import
+_SUGGESTIONS_JSON = _encoder.encode(
+    {
+        "suggestions": [
+            "Tư vấn laptop gaming tầm giá 20 triệu?",
+            "So sánh iPhone 15 Pro và Samsung Galaxy S24 Ultra",
+            "Điện thoại chụp ảnh đẹp giá dưới 10 triệu?",
+            "Tai nghe không dây tốt nhất hiện tại?",
+            "Smart TV 55 inch nào đáng mua nhất?",
+            "Macbook Air M2 có phù hợp cho lập trình không?",
+            "Máy tính bàn để chơi game và làm việc?",
+            "Smartwatch tốt nhất cho người tập thể thao?",
+            # Order flow examples
+            "Tôi muốn đặt hàng iPhone 15",
+            "Shop còn hàng Oppo A18 không?",
+        ],
+        "context": "Sản phẩm điện tử và công nghệ",
+    }
+)
 
-def struct_to_dict(struct_obj) -> Dict:
-    """Convert msgspec Struct to dictionary for JSON serialization."""
-    if hasattr(struct_obj, "__struct_fields__"):
-        # msgspec Struct object
-        result = {}
-        for field in struct_obj.__struct_fields__:
-            result[field] = getattr(struct_obj, field)
-        return result
-    else:
-        # Fallback to __dict__ if available
-        return struct_obj.__dict__ if hasattr(struct_obj, "__dict__") else {}
+# SSE comment line gửi khi stream im lặng quá lâu để proxy không cắt kết nối
+_SSE_KEEPALIVE = b": keepalive\n\n"
+_SSE_KEEPALIVE_INTERVAL = 15.0
+# Header cố định của SSE response; chỉ X-Conversation-ID thay đổi theo request.
+# Content-Type phải đặt tường minh: handler khai báo ChatResponse | Stream nên
+# Litestar lấy media type JSON của handler, bỏ qua media_type của Stream
+_SSE_HEADERS_BASE: Dict[str, str] = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream",
+}
+
+# Timestamp cho response status/debug chỉ cần độ chính xác ~100ms
+_TIMESTAMP_RESOLUTION = 0.1
+_timestamp_cache = ["", 0.0]
+
+
+def now_iso() -> str:
+    """ISO timestamp (UTC) hiện tại, tính lại tối đa mỗi _TIMESTAMP_RESOLUTION giây."""
+    now = time.monotonic()
+    if now - _timestamp_cache[1] > _TIMESTAMP_RESOLUTION:
+        _timestamp_cache[0] = datetime.now(timezone.utc).isoformat()
+        _timestamp_cache[1] = now
+    return _timestamp_cache[0]
+
+
+def sse_frame(chunk: ChatStreamChunk) -> bytes:
+    """Encode ChatStreamChunk thành một SSE frame."""
+    return _SSE_PREFIX + _encoder.encode(chunk) + _SSE_SUFFIX
+
+
+_STREAM_DONE = object()
+
+# Thread pool riêng cho LLM stream: mỗi stream giữ một thread suốt thời gian
+# sinh token, không chiếm default executor (giới hạn theo số CPU)
+_stream_pool = ThreadPoolExecutor(
+    max_workers=config.stream_pool_size, thread_name_prefix="stream"
+)
+
+
+class _StreamError:
+    """Exception từ producer thread, chuyển sang phía async để raise lại."""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def iterate_in_thread(
+    make_iterator: Callable[[], Iterator[str]],
+    maxsize: int = config.stream_queue_maxsize,
+) -> AsyncIterator[str]:
+    """
+    Chạy sync generator trên _stream_pool, đẩy từng item qua asyncio.Queue
+
+    Event loop không bị block trong lúc chờ token kế tiếp; queue có giới hạn
+    nên producer tự dừng lại (backpressure) khi client đọc chậm. Khi queue vượt
+    high water mark, các chunk đang chờ được gộp lại thành một item.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+    high_water = max(1, maxsize * 3 // 4)
+    stopped = threading.Event()
+
+    def put(item) -> None:
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce() -> None:
+        try:
+            for item in make_iterator():
+                if stopped.is_set():
+                    return
+                put(item)
+        except BaseException as e:
+            if not stopped.is_set():
+                put(_StreamError(e))
+            return
+        if not stopped.is_set():
+            put(_STREAM_DONE)
+
+    loop.run_in_executor(_stream_pool, produce)
+    try:
+        pending = None
+        while pending is None:
+            item = await queue.get()
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, _StreamError):
+                raise item.error
+
+            # Client đọc chậm: gộp các chunk đang chờ thay vì gửi từng cái
+            if queue.qsize() >= high_water:
+                parts = [item]
+                while not queue.empty():
+                    nxt = queue.get_nowait()
+                    if nxt is _STREAM_DONE or isinstance(nxt, _StreamError):
+                        pending = nxt
+                        break
+                    parts.append(nxt)
+                item = "".join(parts)
+
+            yield item
+
+        if isinstance(pending, _StreamError):
+            raise pending.error
+    finally:
+        # Client ngắt kết nối: báo producer dừng và giải phóng put đang chờ
+        stopped.set()
+        while not queue.empty():
+            queue.get_nowait()
+
+
+async def with_keepalive(
+    source: AsyncIterator[bytes], interval: float = _SSE_KEEPALIVE_INTERVAL
+) -> AsyncIterator[bytes]:
+    """Chèn keep-alive comment vào SSE stream khi không có frame nào trong interval."""
+    next_frame = asyncio.ensure_future(anext(source))
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_frame}, timeout=interval)
+            if not done:
+                yield _SSE_KEEPALIVE
+                continue
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+            next_frame = asyncio.ensure_future(anext(source))
+    finally:
+        if not next_frame.done():
+            next_frame.cancel()
+            with contextlib.suppress(BaseException):
+                await next_frame
+        await source.aclose()
+
+
+async def _save_messages(queue: asyncio.Queue) -> None:
+    """Worker lưu lần lượt các message trong queue vào conversation history."""
+    while True:
+        conversation_service, message_data = await queue.get()
+        try:
+            await conversation_service.add_message(**message_data)
+            logger.debug(
+                "Message saved to conversation %s", message_data["conversation_id"]
+            )
+        except Exception as e:
+            logger.warning("Failed to save streaming message to conversation: %s", e)
+        finally:
+            queue.task_done()
+
+
+async def enqueue_message_save(
+    conversation_service: ConversationService, **message_data: Any
+) -> None:
+    """
+    Đưa message vào queue lưu nền theo conversation, khởi động worker nếu chưa chạy
+
+    Khi queue đầy (storage chậm hơn tốc độ chat), caller chờ đến khi có chỗ
+    thay vì bỏ message hoặc để queue phình không giới hạn.
+    """
+    if not _message_save_queues:
+        _message_save_queues.extend(
+            asyncio.Queue(maxsize=_MESSAGE_SAVE_QUEUE_MAXSIZE)
+            for _ in range(_MESSAGE_SAVE_WORKERS)
+        )
+    shard = hash(message_data["conversation_id"]) % _MESSAGE_SAVE_WORKERS
+    queue = _message_save_queues[shard]
+    worker = _message_save_workers[shard]
+    if worker is None or worker.done():
+        _message_save_workers[shard] = asyncio.create_task(_save_messages(queue))
+    if queue.full():
+        logger.warning("Message save queue %d is full, waiting for storage", shard)
+    await queue.put((conversation_service, message_data))
+
+
+async def flush_message_saves(_app=None) -> None:
+    """Chờ các message đang chờ lưu xong (dùng khi shutdown)."""
+    for queue in _message_save_queues:
+        await queue.join()
+    for worker in _message_save_workers:
+        if worker is not None:
+            worker.cancel()
+
+
+async def _write_title_updates(conversation_service: ConversationService) -> None:
+    """Worker ghi các title đang chờ theo batch, dừng khi không còn title nào."""
+    while _pending_titles:
+        await asyncio.sleep(_TITLE_FLUSH_INTERVAL)
+        batch = dict(_pending_titles)
+        _pending_titles.clear()
+        try:
+            await conversation_service.update_conversation_titles(batch)
+        except Exception as e:
+            logger.warning("Failed to update %d conversation titles: %s", len(batch), e)
+
+
+def enqueue_title_update(
+    conversation_service: ConversationService,
+    conversation_id: str,
+    title: str,
+    user_id: str,
+) -> None:
+    """Đưa title vào batch kế tiếp, ghi đè title cũ chưa kịp ghi của conversation."""
+    global _title_update_worker
+    _pending_titles[conversation_id] = (title, user_id)
+    if _title_update_worker is None or _title_update_worker.done():
+        _title_update_worker = asyncio.create_task(
+            _write_title_updates(conversation_service)
+        )
+
+
+async def flush_title_updates(_app=None) -> None:
+    """Chờ batch title cuối cùng được ghi xong (dùng khi shutdown)."""
+    if _title_update_worker is not None and not _title_update_worker.done():
+        await _title_update_worker
 
 
 def get_product_assistant() -> ProductAssistantFacade:
     """Get or create ProductAssistantFacade instance."""
     global _facade_instance
     if _facade_instance is None:
-        try:
-            _facade_instance = get_facade()
-            logger.info("ProductAssistantFacade initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize ProductAssistantFacade: {e}")
-            raise HTTPException(
-                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to initialize product assistant service",
-            )
+        with _facade_lock:
+            if _facade_instance is None:
+                try:
+                    _facade_instance = get_facade()
+                    logger.info("ProductAssistantFacade initialized successfully")
+                except Exception:
+                    logger.exception("Failed to initialize ProductAssistantFacade")
+                    raise HTTPException(
+                        status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail="Failed to initialize product assistant service",
+                    )
     return _facade_instance
 
 
@@ -83,87 +367,138 @@ async def get_conversation_service() -> ConversationService:
     global _conversation_service
     try:
         if _conversation_service is None:
-            logger.info(
-                f"Initializing ConversationService with admin_username: {config.api_user}"
-            )
-            _conversation_service = ConversationService(
-                admin_username=config.api_user, redis_url=config.redis_url
-            )
-            logger.info("ConversationService initialized successfully")
+            async with _conversation_service_lock:
+                if _conversation_service is None:
+                    logger.info(
+                        "Initializing ConversationService with admin_username: %s",
+                        config.api_user,
+                    )
+                    _conversation_service = ConversationService(
+                        admin_username=config.api_user, redis_url=config.redis_url
+                    )
+                    logger.info("ConversationService initialized successfully")
         else:
             # Update admin_username in case it wasn't set correctly before
             if _conversation_service.admin_username != config.api_user:
                 logger.warning(
-                    f"Updating ConversationService admin_username from {_conversation_service.admin_username} to {config.api_user}"
+                    "Updating ConversationService admin_username from %s to %s",
+                    _conversation_service.admin_username,
+                    config.api_user,
                 )
                 _conversation_service.admin_username = config.api_user
             logger.debug(
-                f"Using ConversationService with admin_username: {_conversation_service.admin_username}"
+                "Using ConversationService with admin_username: %s",
+                _conversation_service.admin_username,
             )
 
         return _conversation_service
-    except Exception as e:
-        logger.error(f"Failed to initialize ConversationService: {e}")
+    except Exception:
+        logger.exception("Failed to initialize ConversationService")
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to initialize conversation service",
         )
 
 
+def _conversation_pool_stats() -> Optional[Dict[str, int]]:
+    """Pool stats của ConversationService, None nếu service chưa được khởi tạo."""
+    if _conversation_service is None:
+        return None
+    return _conversation_service.pool_stats()
+
+
+def _order_flow_status_skeleton(capabilities: Dict[str, Any]) -> OrderFlowStatus:
+    """Phần cố định của /order-flow-status cho capabilities hiện tại."""
+    global _status_skeleton
+    cached_for, skeleton = _status_skeleton
+    if cached_for is not capabilities or skeleton is None:
+        skeleton = OrderFlowStatus(
+            smart_order_flow_enabled=capabilities["has_order_flow"],
+            agent_type=capabilities["agent_type"],
+            capabilities=OrderFlowCapabilities(
+                intent_analysis=capabilities["has_order_flow"],
+                order_processing=capabilities["has_order_tools"],
+                consultation_flow=True,  # Always available
+                streaming=capabilities["streaming"],
+            ),
+            timestamp="",
+        )
+        _status_skeleton = (capabilities, skeleton)
+    return skeleton
+
+
+def _agent_stats_future(facade: ProductAssistantFacade) -> asyncio.Future:
+    """Future của lần get_stats() đang chạy, tạo mới nếu chưa có."""
+    global _agent_stats_inflight
+    if _agent_stats_inflight is None:
+        _agent_stats_inflight = asyncio.ensure_future(
+            asyncio.to_thread(facade.agent.get_stats)
+        )
+        _agent_stats_inflight.add_done_callback(_remember_agent_stats)
+    return _agent_stats_inflight
+
+
+def _remember_agent_stats(task: asyncio.Future) -> None:
+    """Lưu kết quả get_stats() gần nhất, kể cả khi request đã thôi chờ."""
+    global _agent_stats_inflight
+    _agent_stats_inflight = None
+    if not task.cancelled() and task.exception() is None:
+        _last_agent_stats["stats"] = task.result()
+        _last_agent_stats["fetched_at"] = time.monotonic()
+
+
 def create_conversation_id() -> str:
     """Tạo conversation ID mới."""
-    return str(uuid.uuid4())
+    return uuid.uuid4().hex
 
 
 async def get_or_create_conversation(
     conversation_id: Optional[str], user_id: str, username: str
-) -> str:
-    """Get existing hoặc tạo conversation mới."""
+) -> Tuple[str, Dict]:
+    """Get existing hoặc tạo conversation mới, trả về (ID, metadata)."""
     conversation_service = await get_conversation_service()
+    conversation = await conversation_service.get_or_create_conversation(
+        conversation_id, user_id, username
+    )
+    return conversation["id"], conversation
 
-    if not conversation_id:
-        conversation_id = await conversation_service.create_conversation(
-            user_id=user_id
-        )
-    else:
-        # Check if conversation exists
-        existing_conversation = await conversation_service.get_conversation(
-            conversation_id, user_id, username
-        )
-        if not existing_conversation:
-            # Create new conversation with the provided ID
-            conversation_id = await conversation_service.create_conversation(
-                user_id=user_id
-            )
 
-    return conversation_id
+def build_search_info(facade: ProductAssistantFacade) -> Optional[Dict[str, Any]]:
+    """Search info (trạng thái hệ thống + agent stats) kèm theo chat response."""
+    try:
+        system_info = facade.get_system_info()
+        search_info = {
+            "system_status": system_info["status"],
+            "clean_agent_available": system_info["clean_agent_available"],
+            "capabilities": system_info["capabilities"],
+            "facade_version": system_info.get("facade_version", "1.0"),
+        }
+
+        # Add agent stats if available
+        if "agent_stats" in system_info:
+            search_info["agent_stats"] = system_info["agent_stats"]
+
+        return search_info
+
+    except Exception as e:
+        logger.warning("Could not get search info: %s", e)
+        return None
 
 
 async def stream_chat_response(
     message: str,
     conversation_id: str,
     facade: ProductAssistantFacade,
+    conversation_service: ConversationService,
+    conversation_history: List[Dict],
     user_id: str,
     username: str,
     include_search_info: bool = False,
-) -> AsyncIterator[str]:
+) -> AsyncIterator[bytes]:
     """Stream chat response với Server-Sent Events format."""
     try:
-        conversation_service = await get_conversation_service()
-
-        # Get conversation history for context
-        conversation_messages = await conversation_service.get_conversation_messages(
-            conversation_id, user_id, username
-        )
-        conversation_history = []
-        for msg in conversation_messages:
-            conversation_history.append(
-                {
-                    "message": msg["message"],
-                    "response": msg["response"],
-                    "timestamp": msg["timestamp"],
-                }
-            )
+        # Đọc clock một lần lúc bắt đầu và một lần sau khi stream xong
+        start_time = datetime.now(timezone.utc)
 
         # Send start event
         start_chunk = ChatStreamChunk(
@@ -172,42 +507,37 @@ async def stream_chat_response(
             conversation_id=conversation_id,
             metadata={
                 "message": message,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "timestamp": start_time.isoformat(),
             },
         )
-        yield f"data: {json.dumps(struct_to_dict(start_chunk))}\n\n"
-
-        # Stream response chunks
-        full_response = ""
-        facade = get_product_assistant()
-        for chunk in facade.get_product_recommendations_stream(
-            message, conversation_history
-        ):
-            full_response += chunk
-
-            chunk_data = ChatStreamChunk(
-                type="chunk", content=chunk, conversation_id=conversation_id
+        yield sse_frame(start_chunk)
+
+        # Stream response chunks: type/conversation_id không đổi trong cả stream
+        # nên chỉ encode content cho mỗi chunk (cùng thứ tự field với ChatStreamChunk)
+        chunk_prefix = _SSE_PREFIX + b'{"type":"chunk","content":'
+        chunk_suffix = (
+            b',"conversation_id":'
+            + _encoder.encode(conversation_id)
+            + b',"metadata":null}'
+            + _SSE_SUFFIX
+        )
+        parts: List[str] = []
+        async for chunk in iterate_in_thread(
+            lambda: facade.get_product_recommendations_stream(
+                message, conversation_history
             )
-            yield f"data: {json.dumps(struct_to_dict(chunk_data))}\n\n"
+        ):
+            parts.append(chunk)
+            yield chunk_prefix + _encoder.encode(chunk) + chunk_suffix
+        end_time = datetime.now(timezone.utc)
+        full_response = "".join(parts)
 
         # Get search info if requested (enhanced with LLM decision details)
-        search_info = None
-        if include_search_info:
-            try:
-                system_info = facade.get_system_info()
-                search_info = {
-                    "system_status": system_info["status"],
-                    "clean_agent_available": system_info["clean_agent_available"],
-                    "capabilities": system_info["capabilities"],
-                    "facade_version": system_info.get("facade_version", "1.0"),
-                }
-
-                # Add agent stats if available
-                if "agent_stats" in system_info:
-                    search_info["agent_stats"] = system_info["agent_stats"]
-
-            except Exception as e:
-                logger.warning(f"Could not get search info: {e}")
+        search_info = (
+            await asyncio.to_thread(build_search_info, facade)
+            if include_search_info
+            else None
+        )
 
         # Send end event with metadata IMMEDIATELY
         end_chunk = ChatStreamChunk(
@@ -216,41 +546,33 @@ async def stream_chat_response(
             conversation_id=conversation_id,
             metadata={
                 "total_length": len(full_response),
-                "search_info": search_info if include_search_info else None,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "search_info": search_info,
+                "timestamp": end_time.isoformat(),
             },
         )
-        yield f"data: {json.dumps(struct_to_dict(end_chunk))}\n\n"
+        yield sse_frame(end_chunk)
 
         # Save to conversation history in background (non-blocking)
-        async def save_message_background():
-            try:
-                conversation_service = await get_conversation_service()
-                await conversation_service.add_message(
-                    conversation_id=conversation_id,
-                    message=message,
-                    response=full_response,
-                    user_id=user_id,
-                    username=username,
-                    response_time=0.0,
-                    search_info=search_info,
-                )
-                logger.debug(f"Message saved to conversation {conversation_id}")
-            except Exception as e:
-                logger.warning(f"Failed to save streaming message to conversation: {e}")
-
-        # Start background task for saving
-        asyncio.create_task(save_message_background())
+        await enqueue_message_save(
+            conversation_service,
+            conversation_id=conversation_id,
+            message=message,
+            response=full_response,
+            user_id=user_id,
+            username=username,
+            response_time=(end_time - start_time).total_seconds(),
+            search_info=search_info,
+        )
 
     except Exception as e:
-        logger.error(f"Error in stream_chat_response: {e}")
+        logger.exception("Error in stream_chat_response")
         error_chunk = ChatStreamChunk(
             type="error",
             content=str(e),
             conversation_id=conversation_id,
             metadata={"error_type": type(e).__name__},
         )
-        yield f"data: {json.dumps(struct_to_dict(error_chunk))}\n\n"
+        yield sse_frame(error_chunk)
 
 
 class Chat(Controller):
@@ -259,6 +581,7 @@ class Chat(Controller):
     path = "/chat"
     tags = ["Chat"]
 
+    # SSE response không bị nén: SSEAwareCompressionMiddleware xét Content-Type
     @post("/", status_code=HTTP_200_OK)
     async def chat(
         self, request: Request[User, Token, Any], data: ChatRequest
@@ -267,12 +590,18 @@ class Chat(Controller):
         try:
             user: User = request.user
             facade = get_product_assistant()
+            conversation_service = await get_conversation_service()
 
             # Get or create conversation
-            conversation_id = await get_or_create_conversation(
+            conversation_id, conversation = await get_or_create_conversation(
                 data.conversation_id, user.id, user.username
             )
 
+            # Get conversation history for context (một lần cho cả hai nhánh)
+            conversation_history = await conversation_service.get_conversation_history(
+                conversation_id, user.id, user.username, conversation=conversation
+            )
+
             # Configure web search if specified
             # Web search configuration moved to facade system
             # The facade handles web search internally based on query needs
@@ -280,73 +609,40 @@ class Chat(Controller):
             # Return streaming response if requested
             if data.stream:
                 return Stream(
-                    stream_chat_response(
-                        data.message,
-                        conversation_id,
-                        facade,
-                        user.id,
-                        user.username,
-                        data.include_search_info,
+                    with_keepalive(
+                        stream_chat_response(
+                            data.message,
+                            conversation_id,
+                            facade,
+                            conversation_service,
+                            conversation_history,
+                            user.id,
+                            user.username,
+                            data.include_search_info,
+                        )
                     ),
-                    media_type="text/plain",
-                    headers={
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "Content-Type": "text/event-stream",
-                        "X-Conversation-ID": conversation_id,
-                    },
-                )
-
-            # Get conversation history for context
-            conversation_service = await get_conversation_service()
-            conversation_messages = (
-                await conversation_service.get_conversation_messages(
-                    conversation_id,
-                    user.id,
-                    user.username,
-                )
-            )
-            conversation_history = []
-            for msg in conversation_messages:
-                conversation_history.append(
-                    {
-                        "message": msg["message"],
-                        "response": msg["response"],
-                        "timestamp": msg["timestamp"],
-                    }
+                    media_type="text/event-stream",
+                    headers={**_SSE_HEADERS_BASE, "X-Conversation-ID": conversation_id},
                 )
 
             # Non-streaming response
             start_time = datetime.now(timezone.utc)
-            facade = get_product_assistant()
-            result = facade.get_product_recommendations(
-                data.message, conversation_history
+            # Facade là sync (gọi LLM): chạy trong thread để không block event loop
+            result = await asyncio.to_thread(
+                facade.get_product_recommendations, data.message, conversation_history
             )
             response = result["response"]
             end_time = datetime.now(timezone.utc)
             response_time = (end_time - start_time).total_seconds()
 
             # Get search info if requested (enhanced with LLM decision details)
-            search_info = None
-            if data.include_search_info:
-                try:
-                    system_info = facade.get_system_info()
-                    search_info = {
-                        "system_status": system_info["status"],
-                        "clean_agent_available": system_info["clean_agent_available"],
-                        "capabilities": system_info["capabilities"],
-                        "facade_version": system_info.get("facade_version", "1.0"),
-                    }
-
-                    # Add agent stats if available
-                    if "agent_stats" in system_info:
-                        search_info["agent_stats"] = system_info["agent_stats"]
-
-                except Exception as e:
-                    logger.warning(f"Could not get search info: {e}")
+            search_info = (
+                await asyncio.to_thread(build_search_info, facade)
+                if data.include_search_info
+                else None
+            )
 
             # Save to conversation history
-            conversation_service = await get_conversation_service()
             try:
                 await conversation_service.add_message(
                     conversation_id=conversation_id,
@@ -358,9 +654,9 @@ class Chat(Controller):
                     search_info=search_info,
                 )
             except Exception as e:
-                logger.warning(f"Failed to save message to conversation: {e}")
+                logger.warning("Failed to save message to conversation: %s", e)
 
-            logger.info(f"Chat request processed: {len(data.message)} chars")
+            logger.info("Chat request processed: %d chars", len(data.message))
 
             return ChatResponse(
                 message=data.message,
@@ -368,13 +664,13 @@ class Chat(Controller):
                 conversation_id=conversation_id,
                 response_time=response_time,
                 search_info=search_info,
-                timestamp=datetime.now(timezone.utc).isoformat(),
+                timestamp=end_time.isoformat(),
             )
 
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Chat error: {e}")
+            logger.exception("Chat error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Internal server error during chat: {e!s}",
@@ -408,8 +704,8 @@ class Chat(Controller):
                 message_count=conv.get("message_count", 0),
             )
 
-        except Exception as e:
-            logger.error(f"Create conversation error: {e}")
+        except Exception:
+            logger.exception("Create conversation error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while creating conversation",
@@ -431,22 +727,10 @@ class Chat(Controller):
                 offset=offset,
             )
 
-            conversations = []
-            for conv in conversations_data:
-                conversations.append(
-                    ConversationResponse(
-                        id=conv["id"],
-                        title=conv["title"],
-                        description=conv["description"],
-                        created_at=conv["created_at"],
-                        last_updated=conv["last_updated"],
-                        message_count=conv.get("message_count", 0),
-                    )
-                )
-
-            return conversations
-        except Exception as e:
-            logger.error(f"List conversations error: {e}")
+            # Convert cả list trong C, bỏ qua các field thừa như user_id
+            return msgspec.convert(conversations_data, List[ConversationResponse])
+        except Exception:
+            logger.exception("List conversations error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while listing conversations",
@@ -481,18 +765,7 @@ class Chat(Controller):
             )
 
             # Convert messages to ConversationHistory objects
-            messages = []
-            for msg in messages_data:
-                messages.append(
-                    ConversationHistory(
-                        id=msg["id"],
-                        message=msg["message"],
-                        response=msg["response"],
-                        timestamp=msg["timestamp"],
-                        response_time=msg.get("response_time"),
-                        search_info=msg.get("search_info"),
-                    )
-                )
+            messages = msgspec.convert(messages_data, List[ConversationHistory])
 
             return ChatHistoryResponse(
                 conversation_id=conversation_id,
@@ -504,8 +777,8 @@ class Chat(Controller):
 
         except HTTPException:
             raise
-        except Exception as e:
-            logger.error(f"Get conversation history error: {e}")
+        except Exception:
+            logger.exception("Get conversation history error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while getting conversation history",
@@ -536,8 +809,8 @@ class Chat(Controller):
 
         except HTTPException:
             raise
-        except Exception as e:
-            logger.error(f"Delete conversation error: {e}")
+        except Exception:
+            logger.exception("Delete conversation error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while deleting conversation",
@@ -577,8 +850,8 @@ class Chat(Controller):
 
         except HTTPException:
             raise
-        except Exception as e:
-            logger.error(f"Get search info error: {e}")
+        except Exception:
+            logger.exception("Get search info error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while getting search info",
@@ -595,7 +868,7 @@ class Chat(Controller):
                 "clean_agent_available": system_info["clean_agent_available"],
                 "facade_version": system_info.get("facade_version", "1.0"),
                 "system_status": system_info["status"],
-                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "timestamp": now_iso(),
             }
 
             # Add agent stats if available
@@ -613,8 +886,8 @@ class Chat(Controller):
 
             return response
 
-        except Exception as e:
-            logger.error(f"Get agent stats error: {e}")
+        except Exception:
+            logger.exception("Get agent stats error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while getting agent stats",
@@ -628,7 +901,7 @@ class Chat(Controller):
 
             try:
                 # Try to reset stats via facade
-                agent = facade._get_agent()
+                agent = facade.agent
                 if agent:
                     agent.reset_stats()
                     stats = agent.get_stats()
@@ -636,24 +909,24 @@ class Chat(Controller):
                         "success": True,
                         "message": "Product introduction agent statistics reset successfully",
                         "stats": stats,
-                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "timestamp": now_iso(),
                     }
                 else:
                     return {
                         "success": False,
                         "message": "Product introduction agent not available",
-                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "timestamp": now_iso(),
                     }
             except Exception as e:
-                logger.warning(f"Could not reset agent stats: {e}")
+                logger.warning("Could not reset agent stats: %s", e)
                 return {
                     "success": False,
                     "message": f"Failed to reset stats: {e}",
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "timestamp": now_iso(),
                 }
 
-        except Exception as e:
-            logger.error(f"Reset agent system error: {e}")
+        except Exception:
+            logger.exception("Reset agent system error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while resetting agent system",
@@ -666,25 +939,13 @@ class Chat(Controller):
             facade = get_product_assistant()
 
             try:
-                agent = facade._get_agent()
-                if agent and hasattr(agent, "tools"):
-                    tools_info = []
-                    for tool in agent.tools:
-                        tools_info.append(
-                            {
-                                "name": tool.name,
-                                "description": tool.description,
-                                "args_schema": tool.args_schema.schema()
-                                if tool.args_schema
-                                else None,
-                            }
-                        )
-
+                tools_info = facade.get_tools_info()
+                if tools_info is not None:
                     return {
                         "agent_enabled": True,
                         "available_tools": tools_info,
                         "total_tools": len(tools_info),
-                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "timestamp": now_iso(),
                     }
                 else:
                     # Return clean agent tools information
@@ -709,173 +970,191 @@ class Chat(Controller):
                         ],
                         "total_tools": 3,
                         "message": "Clean product introduction agent operational",
-                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "timestamp": now_iso(),
                     }
             except Exception as e:
-                logger.warning(f"Could not get agent tools: {e}")
+                logger.warning("Could not get agent tools: %s", e)
                 return {
                     "agent_enabled": False,
                     "message": f"Failed to get tools: {e}",
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "timestamp": now_iso(),
                 }
 
-        except Exception as e:
-            logger.error(f"Get tools error: {e}")
+        except Exception:
+            logger.exception("Get tools error")
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error while getting tools",
             )
 
     @get("/suggestions", status_code=HTTP_200_OK)
-    async def get_chat_suggestions(self) -> dict:
+    async def get_chat_suggestions(self) -> Response[bytes]:
         """Lấy gợi ý câu hỏi."""
-        suggestions = [
-            "Tư vấn laptop gaming tầm giá 20 triệu?",
-            "So sánh iPhone 15 Pro và Samsung Galaxy S24 Ultra",
-            "Điện thoại chụp ảnh đẹp giá dưới 10 triệu?",
-            "Tai nghe không dây tốt nhất hiện tại?",
-            "Smart TV 55 inch nào đáng mua nhất?",
-            "Macbook Air M2 có phù hợp cho lập trình không?",
-            "Máy tính bàn để chơi game và làm việc?",
-            "Smartwatch tốt nhất cho người tập thể thao?",
-            # Order flow examples
-            "Tôi muốn đặt hàng iPhone 15",
-            "Shop còn hàng Oppo A18 không?",
-        ]
-
-        return {"suggestions": suggestions, "context": "Sản phẩm điện tử và công nghệ"}
+        return Response(
+            content=_SUGGESTIONS_JSON,
+            media_type=MediaType.JSON,
+            headers={"Cache-Control": "public, max-age=3600"},
+        )
 
     @post("/intent-analysis", status_code=HTTP_200_OK)
+    @error_boundary(
+        "Intent analysis", detail="Internal server error during intent analysis"
+    )
     async def analyze_intent(
         self, request: Request[User, Token, Any], data: dict
-    ) -> dict:
+    ) -> IntentAnalysisResponse:
         """Analyze intent for debugging purposes."""
-        try:
-            message = data.get("message", "").strip()
-            conversation_history = data.get("conversation_history", [])
+        message = data.get("message", "").strip()
+        conversation_history = data.get("conversation_history", [])
 
-            if not message:
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST,
-                    detail="Message is required",
-                )
-
-            # Get the agent and analyze intent
-            facade = get_product_assistant()
-            agent = facade._get_agent()
+        if not message:
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail="Message is required",
+            )
 
-            # Check if it's our UnifiedSmartAgent
-            if hasattr(agent, "_analyze_intent"):
-                # Direct access to intent analysis
-                intent_result = agent._analyze_intent(message, conversation_history)
+        # Get the agent and analyze intent
+        facade = get_product_assistant()
 
-                return {
-                    "message": message,
-                    "intent_analysis": intent_result,
-                    "agent_type": "unified_smart_agent",
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                }
-            else:
-                # Fallback for older agents
-                return {
-                    "message": message,
-                    "intent_analysis": {
-                        "intent_type": "PRODUCT_CONSULTATION",
-                        "confidence": 0.0,
-                        "score": 0,
-                        "triggers": [],
-                        "note": "Intent analysis not available with current agent",
-                    },
-                    "agent_type": "legacy_agent",
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                }
+        # Check if it's our UnifiedSmartAgent
+        if facade.capabilities["has_order_flow"]:
+            # Intent analysis có thể gọi LLM (blocking): chạy ngoài event loop
+            intent_result = await asyncio.to_thread(
+                facade.agent._analyze_intent, message, conversation_history
+            )
 
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Intent analysis error: {e}")
-            raise HTTPException(
-                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error during intent analysis",
+            return IntentAnalysisResponse(
+                message=message,
+                intent_analysis=intent_result,
+                agent_type="unified_smart_agent",
+                timestamp=now_iso(),
+            )
+        else:
+            # Fallback for older agents
+            return IntentAnalysisResponse(
+                message=message,
+                intent_analysis=_LEGACY_INTENT_ANALYSIS,
+                agent_type="legacy_agent",
+                timestamp=now_iso(),
             )
 
     @get("/order-flow-status", status_code=HTTP_200_OK)
-    async def get_order_flow_status(self) -> dict:
-        """Get Smart Order Flow system status."""
-        try:
-            facade = get_product_assistant()
-            agent = facade._get_agent()
+    @error_boundary(
+        "Order flow status",
+        detail="Internal server error while getting order flow status",
+    )
+    async def get_order_flow_status(
+        self, ttl_ms: Optional[int] = None
+    ) -> OrderFlowStatus:
+        """
+        Get Smart Order Flow system status.
+
+        Args:
+            ttl_ms: Tuổi tối đa của snapshot đã cache (ms), 0 để build lại
+        """
+        ttl = _ORDER_FLOW_STATUS_TTL if ttl_ms is None else ttl_ms / 1000
+        cached = _order_flow_status_cache["payload"]
+        if (
+            cached is not None
+            and time.monotonic() - _order_flow_status_cache["fetched_at"] < ttl
+        ):
+            return msgspec.structs.replace(
+                cached,
+                timestamp=now_iso(),
+                conversation_pool=_conversation_pool_stats(),
+            )
 
-            # Check agent type and capabilities
-            agent_type = type(agent).__name__
-            has_order_flow = hasattr(agent, "_analyze_intent")
-            has_order_tools = hasattr(agent, "order_tools") if has_order_flow else False
+        facade = get_product_assistant()
+        capabilities = facade.capabilities
 
-            response = {
-                "smart_order_flow_enabled": has_order_flow,
-                "agent_type": agent_type,
-                "capabilities": {
-                    "intent_analysis": has_order_flow,
-                    "order_processing": has_order_tools,
-                    "consultation_flow": True,  # Always available
-                    "streaming": hasattr(agent, "process_query_stream"),
-                },
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            }
+        stats_task = None
+        if capabilities["has_stats"]:
+            stats_task = _agent_stats_future(facade)
 
-            # Add stats if available
-            if hasattr(agent, "get_stats"):
-                try:
-                    stats = agent.get_stats()
-                    response["statistics"] = stats
-                except Exception as e:
-                    logger.warning(f"Could not get agent stats: {e}")
+        skeleton = _order_flow_status_skeleton(capabilities)
+        conversation_pool = _conversation_pool_stats()
 
-            return response
+        # Add stats if available
+        statistics = None
+        statistics_stale = False
+        if stats_task is not None:
+            try:
+                statistics = await asyncio.wait_for(
+                    asyncio.shield(stats_task), _STATS_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                statistics_stale = True
+                if (
+                    time.monotonic() - _last_agent_stats["fetched_at"]
+                    < _STATS_STALE_TTL
+                ):
+                    statistics = _last_agent_stats["stats"]
+            except Exception as e:
+                logger.warning("Could not get agent stats: %s", e)
+
+        response = msgspec.structs.replace(
+            skeleton,
+            timestamp=now_iso(),
+            conversation_pool=conversation_pool,
+            statistics=statistics,
+            statistics_stale=statistics_stale,
+        )
 
-        except Exception as e:
-            logger.error(f"Order flow status error: {e}")
-            raise HTTPException(
-                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error while getting order flow status",
-            )
+        # Đóng dấu sau khi get_stats() xong để snapshot không bị "già" sẵn;
+        # snapshot có stats cũ thì không cache
+        if not statistics_stale:
+            _order_flow_status_cache["payload"] = response
+            _order_flow_status_cache["fetched_at"] = time.monotonic()
+        return response
 
     @post("/conversations/{conversation_id:str}/title", status_code=HTTP_200_OK)
+    @error_boundary(
+        "Update conversation title",
+        detail="Internal server error while updating conversation title",
+    )
     async def update_conversation_title(
-        self, request: Request[User, Token, Any], conversation_id: str, data: dict
+        self,
+        request: Request[User, Token, Any],
+        conversation_id: str,
+        data: TitleUpdate,
     ) -> SuccessResponse:
         """Cập nhật title của conversation."""
-        try:
-            user: User = request.user
-            conversation_service = await get_conversation_service()
-
-            title = data.get("title", "").strip()
-            if not title:
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST, detail="Title cannot be empty"
-                )
+        user: User = request.user
+        conversation_service = await get_conversation_service()
 
-            success = await conversation_service.update_conversation_title(
-                conversation_id,
-                title,
-                user.id,
-                username=user.username,
+        # Kiểu và độ dài (1..256) đã được msgspec kiểm tra khi decode body
+        raw = data.title
+        if _WS_ONLY(raw):
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST, detail="Title cannot be empty"
             )
+        # Chỉ strip (và cấp phát chuỗi mới) khi hai đầu có whitespace
+        title = raw.strip() if raw[0].isspace() or raw[-1].isspace() else raw
 
-            if not success:
-                raise HTTPException(
-                    status_code=HTTP_404_NOT_FOUND, detail="Conversation not found"
-                )
+        if not await conversation_service.allow_title_update(user.id):
+            raise TooManyRequestsException(detail="Too many title updates")
 
+        # Kiểm tra quyền ngay, việc ghi được đẩy sang batch nền
+        conversation = await conversation_service.get_conversation(
+            conversation_id, user.id, user.username
+        )
+        if not conversation:
+            raise HTTPException(
+                status_code=HTTP_404_NOT_FOUND, detail="Conversation not found"
+            )
+
+        # Title không đổi so với title đã lưu (vd. auto-save) và không có title
+        # khác đang chờ ghi: không cần ghi lại
+        if (
+            conversation.get("title") == title
+            and conversation_id not in _pending_titles
+        ):
             return SuccessResponse(
                 success=True, message="Conversation title updated successfully"
             )
 
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Update conversation title error: {e}")
-            raise HTTPException(
-                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error while updating conversation title",
-            )
+        enqueue_title_update(conversation_service, conversation_id, title, user.id)
+
+        return SuccessResponse(
+            success=True, message="Conversation title updated successfully"
+        )
@@ -0,0 +1,53 @@
+"""
+Error handling helpers dùng chung cho các route handlers.
+"""
+
+import functools
+from typing import Any, Awaitable, Callable, TypeVar
+
+from litestar.exceptions import HTTPException, InternalServerException
+
+from ...config import logger
+
+__author__ = "Lâm Quang Trí"
+__copyright__ = "Copyright 2025, Lâm Quang Trí"
+__credits__ = ["Lâm Quang Trí"]
+
+__maintainer__ = "Lâm Quang Trí"
+__email__ = "quangtri.lam.9@gmail.com"
+__status__ = "Development"
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+def error_boundary(
+    operation: str, detail: str = "Internal server error"
+) -> Callable[[F], F]:
+    """
+    Wrap route handler: giữ nguyên HTTPException, log và chuyển lỗi khác thành 500
+
+    Đặt decorator ngay dưới route decorator (@get/@post/...).
+
+    Args:
+        operation: Tên thao tác dùng trong log
+        detail: Detail trả về cho client khi có lỗi không mong muốn
+
+    Returns:
+        Decorator cho async route handler
+    """
+
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return await fn(*args, **kwargs)
+            except HTTPException:
+                raise
+            except Exception as e:
+                # Lazy %-format; traceback được ghi kèm thay cho str(e)
+                logger.exception("%s error", operation)
+                raise InternalServerException(detail=detail) from e
+
+        return wrapper
+
+    return decorator
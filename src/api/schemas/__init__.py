@@ -19,7 +19,11 @@ from .chat import (
     ConversationCreate,
     ConversationHistory,
     ConversationResponse,
+    IntentAnalysisResponse,
+    OrderFlowCapabilities,
+    OrderFlowStatus,
     SearchInfoResponse,
+    TitleUpdate,
 )
 from .common import ErrorResponse, HealthResponse, PaginationParams, SuccessResponse
 
@@ -41,6 +45,10 @@ __all__ = [
     "ConversationHistory",
     "ConversationCreate",
     "ConversationResponse",
+    "IntentAnalysisResponse",
+    "OrderFlowCapabilities",
+    "OrderFlowStatus",
+    "TitleUpdate",
     # Common schemas
     "ErrorResponse",
     "SuccessResponse",
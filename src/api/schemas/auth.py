@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Optional
 
-from msgspec import Struct
+from msgspec import Meta, Struct
 
 __author__ = "Lâm Quang Trí"
 __copyright__ = "Copyright 2025, Lâm Quang Trí"
@@ -11,6 +11,10 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+# Giới hạn độ dài được kiểm tra ngay khi decode body, trước khi vào handler
+Username = Annotated[str, Meta(min_length=3, max_length=64)]
+Password = Annotated[str, Meta(min_length=1, max_length=128)]
+
 
 class User(Struct):
     """User model for authentication"""
@@ -26,11 +30,11 @@ class User(Struct):
 class LoginRequest(Struct):
     """Request model for login"""
 
-    username: str
-    password: str
+    username: Username
+    password: Password
 
 
-class LoginResponse(Struct, kw_only=True):
+class LoginResponse(Struct, kw_only=True, frozen=True, gc=False):
     """Response model for successful login"""
 
     access_token: str
@@ -53,11 +57,11 @@ class TokenPayload(Struct):
 class RegisterRequest(Struct):
     """Request model for user registration"""
 
-    username: str
-    password: str
+    username: Username
+    password: Password
 
 
-class RegisterResponse(Struct, kw_only=True):
+class RegisterResponse(Struct, kw_only=True, frozen=True, gc=False):
     """Response model for successful registration"""
 
     user_id: str
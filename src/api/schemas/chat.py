@@ -2,9 +2,9 @@
 Chat schemas cho chatbot interactions.
 """
 
-from typing import Any
+from typing import Annotated, Any
 
-from msgspec import Struct
+from msgspec import Meta, Struct
 
 
 __author__ = "Lâm Quang Trí"
@@ -15,6 +15,9 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+# Giới hạn độ dài được kiểm tra ngay khi decode body, trước khi vào handler
+Title = Annotated[str, Meta(min_length=1, max_length=256)]
+
 
 class ChatRequest(Struct):
     """Schema cho chat request."""
@@ -55,14 +58,14 @@ class ChatStreamResponse(Struct):
     stream_url: str | None = None
 
 
-class ConversationHistory(Struct):
+class ConversationHistory(Struct, gc=False):
     """Schema cho conversation history item."""
 
     id: str
     message: str
     response: str
     timestamp: str
-    response_time: float
+    response_time: float | None = None
     search_info: dict[str, Any] | None = None
 
 
@@ -88,6 +91,36 @@ class SearchInfoResponse(Struct):
     web_results: list[dict[str, Any]] | None = None
 
 
+class OrderFlowCapabilities(Struct, frozen=True, gc=False):
+    """Schema cho capabilities của Smart Order Flow."""
+
+    intent_analysis: bool
+    order_processing: bool
+    consultation_flow: bool
+    streaming: bool
+
+
+class OrderFlowStatus(Struct, frozen=True, kw_only=True, omit_defaults=True):
+    """Schema cho Smart Order Flow status."""
+
+    smart_order_flow_enabled: bool
+    agent_type: str
+    capabilities: OrderFlowCapabilities
+    timestamp: str
+    conversation_pool: dict[str, int] | None = None
+    statistics: dict[str, Any] | None = None
+    statistics_stale: bool = False
+
+
+class IntentAnalysisResponse(Struct, frozen=True):
+    """Schema cho intent analysis response."""
+
+    message: str
+    intent_analysis: dict[str, Any]
+    agent_type: str
+    timestamp: str
+
+
 class ConversationCreate(Struct):
     """Schema cho tạo conversation mới."""
 
@@ -95,7 +128,7 @@ class ConversationCreate(Struct):
     description: str | None = None
 
 
-class ConversationResponse(Struct):
+class ConversationResponse(Struct, gc=False):
     """Schema cho conversation response."""
 
     id: str
@@ -103,7 +136,7 @@ class ConversationResponse(Struct):
     description: str | None
     created_at: str
     last_updated: str
-    message_count: int
+    message_count: int = 0
 
 
 class ConversationUpdate(Struct):
@@ -113,6 +146,12 @@ class ConversationUpdate(Struct):
     description: str | None = None
 
 
+class TitleUpdate(Struct, frozen=True, gc=False):
+    """Schema cho cập nhật title của conversation."""
+
+    title: Title
+
+
 class ChatSettings(Struct):
     """Schema cho chat settings."""
 
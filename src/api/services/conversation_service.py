@@ -2,20 +2,28 @@
 Conversation service for managing chat history in Qdrant vector database.
 """
 
+import asyncio
+import functools
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
-import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import msgspec
 import redis.asyncio as redis
 
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import (
+    Direction,
     Distance,
     PointStruct,
     VectorParams,
     Filter,
     FieldCondition,
     MatchValue,
+    OrderBy,
+    PayloadSchemaType,
+    SetPayload,
+    SetPayloadOperation,
 )
 
 from ...config import config, logger
@@ -28,6 +36,28 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+# Encode/decode cache Redis bằng msgspec thay cho json.dumps/json.loads
+_cache_encoder = msgspec.json.Encoder()
+_cache_decoder = msgspec.json.Decoder(List[Dict])
+
+# Fixed window counter cho title update: INCR + PEXPIRE trong một round-trip
+_TITLE_UPDATE_LIMIT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+# Bộ đếm message_count nguyên tử, dùng chung giữa các worker: lần đầu được
+# khởi tạo từ giá trị đang lưu trong Qdrant (ARGV[1]) rồi INCR
+_MESSAGE_COUNT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return redis.call('INCR', KEYS[1])
+"""
+
 
 class ConversationService:
     """Service for managing conversations in Qdrant vector database."""
@@ -45,9 +75,39 @@ class ConversationService:
         self.messages_collection = "conversation_messages"
         self.admin_username = admin_username
         self.redis_client = None
+        self._title_update_limit_script = None
+        self._message_count_script = None
         self.redis_url = redis_url
+        # QdrantClient là sync: chạy trên pool riêng có giới hạn để không block
+        # event loop và không tranh default executor với các route khác
+        self._qdrant_pool_size = config.conversation_pool_size
+        self._qdrant_pool = ThreadPoolExecutor(
+            max_workers=self._qdrant_pool_size,
+            thread_name_prefix="conversation",
+        )
+        # Số Qdrant call đang chạy hoặc chờ trên pool (chỉ đọc/ghi trên event loop)
+        self._qdrant_inflight = 0
         self._ensure_collections()
 
+    async def _run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Chạy một Qdrant call trên pool của service."""
+        self._qdrant_inflight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._qdrant_pool, functools.partial(func, *args, **kwargs)
+            )
+        finally:
+            self._qdrant_inflight -= 1
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Thống kê pool của service (cho endpoint status)."""
+        return {
+            "qdrant_workers": self._qdrant_pool_size,
+            "qdrant_inflight": self._qdrant_inflight,
+            "qdrant_queued": max(0, self._qdrant_inflight - self._qdrant_pool_size),
+            "redis_max_connections": config.redis_max_connections,
+        }
+
     def _ensure_collections(self) -> None:
         """Ensure required collections exist."""
         collections = self.client.get_collections().collections
@@ -64,6 +124,19 @@ class ConversationService:
             )
             logger.info(f"Created collection: {self.conversations_collection}")
 
+        # Payload index: lọc theo user và order_by created_at ngay trong Qdrant
+        # (tạo lại index đã có là no-op nên chạy cả cho collection cũ)
+        self.client.create_payload_index(
+            collection_name=self.conversations_collection,
+            field_name="user_id",
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+        self.client.create_payload_index(
+            collection_name=self.conversations_collection,
+            field_name="created_at",
+            field_schema=PayloadSchemaType.DATETIME,
+        )
+
         # Create messages collection if not exists
         if self.messages_collection not in collection_names:
             self.client.create_collection(
@@ -75,10 +148,34 @@ class ConversationService:
             )
             logger.info(f"Created collection: {self.messages_collection}")
 
+        # Payload index: lọc theo conversation và order_by timestamp trong Qdrant
+        self.client.create_payload_index(
+            collection_name=self.messages_collection,
+            field_name="conversation_id",
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+        self.client.create_payload_index(
+            collection_name=self.messages_collection,
+            field_name="timestamp",
+            field_schema=PayloadSchemaType.DATETIME,
+        )
+
     async def get_redis_client(self) -> redis.Redis:
         """Get or create Redis client."""
         if self.redis_client is None:
-            self.redis_client = redis.from_url(self.redis_url, decode_responses=True)
+            # Pool có giới hạn: khi hết connection thì chờ thay vì mở thêm
+            pool = redis.BlockingConnectionPool.from_url(
+                self.redis_url,
+                max_connections=config.redis_max_connections,
+                decode_responses=True,
+            )
+            self.redis_client = redis.Redis(connection_pool=pool)
+            self._title_update_limit_script = self.redis_client.register_script(
+                _TITLE_UPDATE_LIMIT_SCRIPT
+            )
+            self._message_count_script = self.redis_client.register_script(
+                _MESSAGE_COUNT_SCRIPT
+            )
             logger.info("Redis client initialized for ConversationService")
         return self.redis_client
 
@@ -89,7 +186,18 @@ class ConversationService:
         description: Optional[str] = None,
     ) -> str:
         """Create a new conversation."""
-        conversation_id = str(uuid.uuid4())
+        conversation = await self._insert_conversation(user_id, title, description)
+        return conversation["id"]
+
+    async def _insert_conversation(
+        self,
+        user_id: Optional[str] = None,
+        title: Optional[str] = None,
+        description: Optional[str] = None,
+    ) -> Dict:
+        """Create a new conversation and return its metadata."""
+        # Dạng hex 32 ký tự (không gạch nối), Qdrant vẫn nhận như UUID
+        conversation_id = uuid.uuid4().hex
         now = datetime.now(timezone.utc)
 
         # Create conversation metadata
@@ -113,12 +221,37 @@ class ConversationService:
             payload=conversation_data,
         )
 
-        self.client.upsert(
-            collection_name=self.conversations_collection, points=[point]
+        await self._run(
+            self.client.upsert,
+            collection_name=self.conversations_collection,
+            points=[point],
         )
 
         logger.info(f"Created conversation: {conversation_id}")
-        return conversation_id
+        return conversation_data
+
+    async def get_or_create_conversation(
+        self,
+        conversation_id: Optional[str],
+        user_id: str,
+        username: str,
+    ) -> Dict:
+        """
+        Get conversation nếu tồn tại và user có quyền, nếu không thì tạo mới
+
+        Chỉ một lần retrieve cho conversation đã có, một lần upsert cho
+        conversation mới; metadata được trả về luôn nên caller không cần
+        get_conversation lại. Conversation không thuộc về user luôn được tạo
+        với ID mới, không ghi đè lên ID được truyền vào.
+        """
+        if conversation_id:
+            conversation = await self.get_conversation(
+                conversation_id, user_id, username
+            )
+            if conversation:
+                return conversation
+
+        return await self._insert_conversation(user_id=user_id)
 
     async def get_conversation(
         self,
@@ -128,8 +261,10 @@ class ConversationService:
     ) -> Optional[Dict]:
         """Get conversation by ID with user permission check."""
         try:
-            result = self.client.retrieve(
-                collection_name=self.conversations_collection, ids=[conversation_id]
+            result = await self._run(
+                self.client.retrieve,
+                collection_name=self.conversations_collection,
+                ids=[conversation_id],
             )
 
             if not result:
@@ -193,7 +328,7 @@ class ConversationService:
             cached_conversations = await redis_client.get(cache_key)
             if cached_conversations:
                 logger.info(f"Cache hit for conversations list: {cache_key}")
-                return json.loads(cached_conversations)
+                return _cache_decoder.decode(cached_conversations)
 
             # Prepare filter for Qdrant query
             scroll_filter = None
@@ -204,31 +339,31 @@ class ConversationService:
                     ]
                 )
 
-            # Use Qdrant scroll with pagination and filter
-            # Note: Cannot use order_by without a range index, so we retrieve items and sort manually
-            result = self.client.scroll(
+            # Qdrant trả về sẵn theo created_at giảm dần (range index), chỉ
+            # đọc limit + offset point đầu; order_by không hỗ trợ offset nên
+            # bỏ qua offset point đầu ở đây
+            result = await self._run(
+                self.client.scroll,
                 collection_name=self.conversations_collection,
                 scroll_filter=scroll_filter,
                 limit=limit + offset,
+                order_by=OrderBy(key="created_at", direction=Direction.DESC),
+                with_vectors=False,
             )
 
             conversations = []
             if result and result[0]:
                 logger.info(f"Retrieved {len(result[0])} conversations from Qdrant")
-                for point in result[0]:
-                    conv_data = point.payload
-                    conversations.append(conv_data)
-                # Sort by created_at descending manually
-                conversations.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-                # Manually apply offset and limit for pagination
-                conversations = conversations[offset : offset + limit]
+                conversations = [point.payload for point in result[0][offset:]]
 
             logger.info(
                 f"Returning {len(conversations)} conversations for user {username} (ID: {user_id})"
             )
 
             # Cache the result in Redis with TTL of 5 minutes
-            await redis_client.setex(cache_key, 300, json.dumps(conversations))
+            await redis_client.setex(
+                cache_key, 300, _cache_encoder.encode(conversations)
+            )
             logger.info(f"Cached conversations list: {cache_key}")
 
             return conversations
@@ -253,7 +388,8 @@ class ConversationService:
                 return False
 
             # Delete all messages in the conversation
-            self.client.delete(
+            await self._run(
+                self.client.delete,
                 collection_name=self.messages_collection,
                 points_selector=Filter(
                     must=[
@@ -266,7 +402,8 @@ class ConversationService:
             )
 
             # Delete the conversation
-            self.client.delete(
+            await self._run(
+                self.client.delete,
                 collection_name=self.conversations_collection,
                 points_selector=[conversation_id],
             )
@@ -283,6 +420,7 @@ class ConversationService:
                 logger.info(
                     f"Invalidated cache for messages of conversation {conversation_id}"
                 )
+            await redis_client.delete(f"msgcount:{conversation_id}")
 
             logger.info(f"Deleted conversation: {conversation_id}")
             return True
@@ -310,7 +448,7 @@ class ConversationService:
             if not conversation:
                 raise ValueError("Conversation not found or access denied")
 
-            message_id = str(uuid.uuid4())
+            message_id = uuid.uuid4().hex
             now = datetime.now(timezone.utc)
 
             # Create message data
@@ -331,28 +469,31 @@ class ConversationService:
                 payload=message_data,
             )
 
-            self.client.upsert(collection_name=self.messages_collection, points=[point])
-
-            # Update conversation metadata in a single operation
-            result = self.client.retrieve(
-                collection_name=self.conversations_collection, ids=[conversation_id]
+            await self._run(
+                self.client.upsert,
+                collection_name=self.messages_collection,
+                points=[point],
             )
-            if result:
-                conversation_data = result[0].payload
-                conversation_data["last_updated"] = now.isoformat()
-                conversation_data["message_count"] = (
-                    conversation_data.get("message_count", 0) + 1
-                )
 
-                update_point = PointStruct(
-                    id=conversation_id, vector=[0.0], payload=conversation_data
-                )
-                self.client.upsert(
-                    collection_name=self.conversations_collection, points=[update_point]
-                )
+            # Update conversation metadata: message_count tăng bằng Redis INCR
+            # nguyên tử nên các message đồng thời (kể cả từ worker khác) không
+            # mất lượt đếm; set_payload chỉ ghi hai field nên không đè title
+            redis_client = await self.get_redis_client()
+            message_count = await self._message_count_script(
+                keys=[f"msgcount:{conversation_id}"],
+                args=[conversation.get("message_count", 0)],
+            )
+            await self._run(
+                self.client.set_payload,
+                collection_name=self.conversations_collection,
+                payload={
+                    "last_updated": now.isoformat(),
+                    "message_count": message_count,
+                },
+                points=[conversation_id],
+            )
 
             # Invalidate cache for this conversation's messages
-            redis_client = await self.get_redis_client()
             keys = await redis_client.keys(f"messages:{conversation_id}:*")
             if keys:
                 await redis_client.delete(*keys)
@@ -380,13 +521,26 @@ class ConversationService:
         username: str,
         limit: int = 3,
         offset: int = 0,
+        conversation: Optional[Dict] = None,
     ) -> List[Dict]:
-        """Get messages for a conversation."""
+        """
+        Get messages for a conversation
+
+        Trả về limit message mới nhất (bỏ qua offset message mới nhất) theo thứ
+        tự timestamp tăng dần, nên lượt mới luôn được append vào cuối cửa sổ.
+
+        Args:
+            limit: Số message tối đa
+            offset: Số message mới nhất cần bỏ qua
+            conversation: Metadata đã lấy (và kiểm tra quyền) trước đó, nếu có
+                thì bỏ qua bước retrieve kiểm tra quyền
+        """
         try:
             # Check if conversation exists and user has permission
-            conversation = await self.get_conversation(
-                conversation_id, user_id, username
-            )
+            if conversation is None:
+                conversation = await self.get_conversation(
+                    conversation_id, user_id, username
+                )
             if not conversation:
                 return []
 
@@ -396,7 +550,7 @@ class ConversationService:
             cached_messages = await redis_client.get(cache_key)
             if cached_messages:
                 logger.info(f"Cache hit for messages: {cache_key}")
-                return json.loads(cached_messages)
+                return _cache_decoder.decode(cached_messages)
 
             # Get messages for the conversation from Qdrant
             filter_condition = Filter(
@@ -407,23 +561,24 @@ class ConversationService:
                 ]
             )
 
-            result = self.client.scroll(
+            # Qdrant trả về theo timestamp giảm dần (range index); order_by không
+            # hỗ trợ offset nên đọc limit + offset point rồi bỏ offset point đầu
+            result = await self._run(
+                self.client.scroll,
                 collection_name=self.messages_collection,
                 scroll_filter=filter_condition,
                 limit=limit + offset,
+                order_by=OrderBy(key="timestamp", direction=Direction.DESC),
+                with_vectors=False,
             )
 
             messages = []
             if result and result[0]:
-                for point in result[0]:
-                    messages.append(point.payload)
-                # Sort by timestamp ascending manually
-                messages.sort(key=lambda x: x.get("timestamp", ""))
-                # Manually apply offset and limit for pagination
-                messages = messages[offset : offset + limit]
+                messages = [point.payload for point in result[0][offset:]]
+                messages.reverse()
 
             # Cache the result in Redis with TTL of 5 minutes
-            await redis_client.setex(cache_key, 300, json.dumps(messages))
+            await redis_client.setex(cache_key, 300, _cache_encoder.encode(messages))
             logger.info(f"Cached messages: {cache_key}")
 
             return messages
@@ -434,6 +589,32 @@ class ConversationService:
             )
             return []
 
+    async def get_conversation_history(
+        self,
+        conversation_id: str,
+        user_id: str,
+        username: str,
+        conversation: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """
+        Get history của conversation làm context cho agent
+
+        Chỉ gồm message/response, không có field thay đổi theo thời gian như
+        timestamp, để prompt của các lượt sau có cùng prefix với lượt trước
+        (provider prompt cache).
+
+        Args:
+            conversation: Metadata từ get_or_create_conversation, nếu có thì
+                không retrieve lại để kiểm tra quyền
+        """
+        if conversation is not None and conversation.get("message_count") == 0:
+            # Conversation mới/chưa có message: không cần query Qdrant
+            return []
+        messages = await self.get_conversation_messages(
+            conversation_id, user_id, username, conversation=conversation
+        )
+        return [{"message": m["message"], "response": m["response"]} for m in messages]
+
     # Deprecated methods, replaced by combined update in add_message
     def _update_conversation_last_updated(self, conversation_id: str) -> None:
         """Deprecated: Update conversation's last_updated timestamp."""
@@ -453,33 +634,53 @@ class ConversationService:
         """Set the admin username."""
         self.admin_username = admin_username
 
-    def update_conversation_title(
-        self,
-        conversation_id: str,
-        title: str,
-        user_id: str,
-        username: str,
-    ) -> bool:
-        """Update conversation title."""
-        try:
-            # Check if conversation exists and user has permission
-            conversation = self.get_conversation(conversation_id, user_id, username)
-            if not conversation:
-                return False
-
-            conversation["title"] = title
-            conversation["last_updated"] = datetime.now(timezone.utc).isoformat()
+    async def allow_title_update(self, user_id: str) -> bool:
+        """
+        Ghi nhận một lần đổi title của user và kiểm tra giới hạn
 
-            # Update the conversation
-            point = PointStruct(id=conversation_id, vector=[0.0], payload=conversation)
+        Args:
+            user_id: ID của user
 
-            self.client.upsert(
-                collection_name=self.conversations_collection, points=[point]
+        Returns:
+            False nếu user đã vượt title_update_limit trong window hiện tại
+        """
+        await self.get_redis_client()
+        count = await self._title_update_limit_script(
+            keys=[f"tl:{user_id}"],
+            args=[config.title_update_window_seconds * 1000],
+        )
+        return count <= config.title_update_limit
+
+    async def update_conversation_titles(
+        self, titles: Dict[str, Tuple[str, str]]
+    ) -> None:
+        """
+        Ghi title mới cho nhiều conversation trong một request tới Qdrant.
+
+        Args:
+            titles: conversation_id -> (title, user_id); quyền đã được kiểm tra trước
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        operations = [
+            SetPayloadOperation(
+                set_payload=SetPayload(
+                    payload={"title": title, "last_updated": now},
+                    points=[conversation_id],
+                )
             )
+            for conversation_id, (title, _) in titles.items()
+        ]
+        await self._run(
+            self.client.batch_update_points,
+            collection_name=self.conversations_collection,
+            update_operations=operations,
+        )
 
-            logger.info(f"Updated title for conversation {conversation_id}")
-            return True
+        # Invalidate cache for conversation list of affected users
+        redis_client = await self.get_redis_client()
+        for user_id in {user_id for _, user_id in titles.values()}:
+            keys = await redis_client.keys(f"conversations:{user_id}:*")
+            if keys:
+                await redis_client.delete(*keys)
 
-        except Exception as e:
-            logger.error(f"Error updating conversation title {conversation_id}: {e}")
-            return False
+        logger.info(f"Updated titles for {len(operations)} conversations")
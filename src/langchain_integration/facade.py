@@ -16,6 +16,16 @@ __maintainer__ = "Lâm Quang Trí"
 __email__ = "quangtri.lam.9@gmail.com"
 __status__ = "Development"
 
+# Capabilities cố định của facade, dùng chung cho mọi lần get_system_info()
+_SYSTEM_CAPABILITIES = (
+    "product_recommendations",
+    "enhanced_search",
+    "smart_deduplication",
+    "conversation_context",
+    "id_cleaning",
+    "professional_responses",
+)
+
 
 class ProductAssistantFacade:
     """
@@ -29,6 +39,8 @@ class ProductAssistantFacade:
     def __init__(self):
         """Initialize the facade with clean, working systems."""
         self._agent = None
+        self._tools_info: Optional[List[Dict[str, Any]]] = None
+        self._capabilities: Optional[Dict[str, Any]] = None
         self.logger = logger
 
     def _get_agent(self):
@@ -59,6 +71,71 @@ class ProductAssistantFacade:
                     self._agent = None
         return self._agent
 
+    @property
+    def agent(self):
+        """Agent đang dùng; chỉ đi qua _get_agent() khi chưa load được."""
+        agent = self._agent
+        if agent is None:
+            agent = self._get_agent()
+        return agent
+
+    @property
+    def capabilities(self) -> Dict[str, Any]:
+        """
+        Capability flags của agent, probe một lần rồi cache lại.
+
+        Returns:
+            Dict gồm agent_type, has_order_flow, has_order_tools, streaming, has_stats
+        """
+        if self._capabilities is None:
+            agent = self.agent
+            has_order_flow = hasattr(agent, "_analyze_intent")
+            capabilities = {
+                "agent_type": type(agent).__name__,
+                "has_order_flow": has_order_flow,
+                "has_order_tools": has_order_flow and hasattr(agent, "order_tools"),
+                "streaming": hasattr(agent, "process_query_stream"),
+                "has_stats": hasattr(agent, "get_stats"),
+            }
+            if agent is None:
+                # Agent chưa load được, lần sau probe lại
+                return capabilities
+            self._capabilities = capabilities
+        return self._capabilities
+
+    def get_tools_info(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get thông tin tools của agent (name, description, JSON schema của args).
+
+        Schema chỉ được build một lần cho mỗi agent rồi cache lại.
+
+        Returns:
+            List thông tin tools, None nếu agent không có tools
+        """
+        agent = self.agent
+        if not agent or not hasattr(agent, "tools"):
+            return None
+
+        if self._tools_info is None:
+            tools_info = []
+            for tool in agent.tools:
+                args_schema = tool.args_schema
+                if args_schema is not None and hasattr(
+                    args_schema, "model_json_schema"
+                ):
+                    args_schema = args_schema.model_json_schema()
+                elif args_schema is not None and hasattr(args_schema, "schema"):
+                    args_schema = args_schema.schema()
+                tools_info.append(
+                    {
+                        "name": tool.name,
+                        "description": tool.description,
+                        "args_schema": args_schema,
+                    }
+                )
+            self._tools_info = tools_info
+        return self._tools_info
+
     def get_product_recommendations(
         self, query: str, conversation_history: Optional[List[dict]] = None
     ) -> Dict[str, Any]:
@@ -157,18 +234,12 @@ class ProductAssistantFacade:
                 "facade_version": "2.0",
                 "clean_agent_available": agent is not None,
                 "timestamp": datetime.now().isoformat(),
-                "capabilities": [
-                    "product_recommendations",
-                    "enhanced_search",
-                    "smart_deduplication",
-                    "conversation_context",
-                    "id_cleaning",
-                    "professional_responses",
-                ],
+                "capabilities": _SYSTEM_CAPABILITIES,
                 "status": "operational" if agent else "degraded",
             }
 
-            if agent:
+            # has_stats đã được probe một lần, không để AttributeError mỗi request
+            if agent and self.capabilities["has_stats"]:
                 try:
                     agent_stats = agent.get_stats()
                     info["agent_stats"] = agent_stats